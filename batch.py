@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Sharded, resumable batch runs of the main.py detector over a large input tree
+- Several machines (nodes) share one state directory on a common filesystem
+- Work is split either deterministically (--shard i/N, by a stable hash of the relative path)
+  or dynamically through lock-file leases on fixed-size chunks (--lease); leases of dead
+  nodes expire and are taken over
+- Every node appends its results to results-<node>.jsonl and, once they are flushed to disk,
+  records the finished items in journal-<node>.jsonl; a restarted run skips journaled items
+- `merge` combines all per-node results into one JSON Lines file (one record per image)
+- `--local-nodes K` starts K local processes as stand-in nodes for testing
+
+State directory layout:
+  manifest.txt            sorted relative paths of all images (written once by the first node)
+  journal-<node>.jsonl    {"item": ..., "status": "ok" | "error", ...} per finished item
+  results-<node>.jsonl    {"image": ..., "balls": [...], ...} per detected image
+  leases/chunk-NNNNNN.lease / .done
+
+Usage:
+  python3 batch.py run archive/ --state-dir /mnt/shared/run1 --shard 0/4       # on node 0 of 4
+  python3 batch.py run archive/ --state-dir /mnt/shared/run1 --lease           # on any number of nodes
+  python3 batch.py run archive/ --state-dir /tmp/run --lease --local-nodes 3   # local test
+  python3 batch.py status --state-dir /mnt/shared/run1
+  python3 batch.py merge --state-dir /mnt/shared/run1 --output merged.jsonl
+
+"""
+
+import argparse
+import glob
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import zlib
+
+import cv2
+
+import main as detector
+from output_writer import OutputWriter
+from preprocess import Preprocessor, configure_threads, worker_threads
+from profiles import compile_profile, load_profile
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+
+
+def scan_images(root):
+    """Sorted relative paths (with '/' separators) of all images below `root`."""
+    items = []
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                rel = os.path.relpath(os.path.join(folder, name), root)
+                items.append(rel.replace(os.sep, '/'))
+    items.sort()
+    return items
+
+
+def load_manifest(root, state_dir):
+    """
+    Return the run's item list, creating manifest.txt on first use.
+
+    The first node to finish scanning publishes its list with an atomic hard link,
+    so all nodes agree on the same items (and chunk numbering) even if the tree changes.
+    """
+    manifest = os.path.join(state_dir, 'manifest.txt')
+    if not os.path.isfile(manifest):
+        items = scan_images(root)
+        tmp = f"{manifest}.{socket.gethostname()}-{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(items) + ('\n' if items else ''))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(tmp, manifest)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+    with open(manifest, 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+
+def parse_shard(text):
+    """'i/N' -> (i, N)"""
+    try:
+        index, count = (int(v) for v in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must look like i/N, got '{text}'")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, N), got '{text}'")
+    return index, count
+
+
+def shard_of(item, count):
+    """Stable shard number of an item, independent of listing order and Python hash seed."""
+    return zlib.crc32(item.encode('utf-8')) % count
+
+
+def read_journals(state_dir):
+    """Return {item: status} over all nodes' journals."""
+    done = {}
+    for fp in sorted(glob.glob(os.path.join(state_dir, 'journal-*.jsonl'))):
+        with open(fp, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A node died mid-write; the item is simply redone
+                    continue
+                done[entry['item']] = entry['status']
+    return done
+
+
+class Journal:
+    """Append-only checkpoint of finished items for one node."""
+
+    def __init__(self, state_dir, node):
+        self.path = os.path.join(state_dir, f'journal-{node}.jsonl')
+        self._f = open(self.path, 'a', encoding='utf-8')
+
+    def record(self, entries):
+        for entry in entries:
+            self._f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self._f.close()
+
+
+class LeaseManager:
+    """Claim fixed-size chunks of the manifest through lock files in a shared directory."""
+
+    def __init__(self, state_dir, node, timeout):
+        self.dir = os.path.join(state_dir, 'leases')
+        os.makedirs(self.dir, exist_ok=True)
+        self.node = node
+        self.timeout = timeout
+        self._last_heartbeat = 0.0
+
+    def _path(self, chunk, suffix):
+        return os.path.join(self.dir, f'chunk-{chunk:06d}.{suffix}')
+
+    def is_done(self, chunk):
+        return os.path.exists(self._path(chunk, 'done'))
+
+    def _create(self, chunk):
+        try:
+            fd = os.open(self._path(chunk, 'lease'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(f'{self.node} {time.time():.6f}\n')
+        # The owner may have completed the chunk (.done, then unlink) just before we created the lease
+        if self.is_done(chunk):
+            self._release(chunk)
+            return False
+        return True
+
+    def _release(self, chunk):
+        try:
+            os.remove(self._path(chunk, 'lease'))
+        except FileNotFoundError:
+            pass
+
+    def _read_lease(self, path):
+        """(mtime, contents) of a lease file, or None if it is gone."""
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path, 'r') as f:
+                return mtime, f.read()
+        except FileNotFoundError:
+            return None
+
+    def acquire(self, chunk):
+        """Try to take the chunk; expired leases of other nodes are taken over."""
+        if self.is_done(chunk):
+            return False
+        if self._create(chunk):
+            return True
+        lease = self._path(chunk, 'lease')
+        observed = self._read_lease(lease)
+        if observed is None:
+            return self._create(chunk)
+        age = time.time() - observed[0]
+        if age < self.timeout:
+            return False
+        # Several nodes may see the same expired lease; move it aside and make sure what
+        # was moved is still that lease and not a fresh one another node created meanwhile
+        stale = f'{lease}.stale-{self.node}'
+        try:
+            os.rename(lease, stale)
+        except FileNotFoundError:
+            return False
+        if self._read_lease(stale) != observed:
+            # Not ours to take: put it back unless a newer lease already exists, then back off
+            try:
+                os.link(stale, lease)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        print(f"Taking over expired lease on chunk {chunk} ({age:.0f}s old)")
+        return self._create(chunk)
+
+    def heartbeat(self, chunk):
+        """Refresh the lease mtime (at most every few seconds)."""
+        now = time.time()
+        if now - self._last_heartbeat >= min(10.0, self.timeout / 4):
+            try:
+                os.utime(self._path(chunk, 'lease'))
+            except FileNotFoundError:
+                pass
+            self._last_heartbeat = now
+
+    def complete(self, chunk):
+        with open(self._path(chunk, 'done'), 'w') as f:
+            f.write(f'{self.node} {time.time():.0f}\n')
+        self._release(chunk)
+
+
+class BatchRunner:
+    """Detect items, write results and checkpoint them for one node."""
+
+    def __init__(self, root, state_dir, node, profile, writer_threads):
+        self.root = root
+        self.profile = profile
+        self.preprocessor = Preprocessor(profile)
+        self.writer = OutputWriter(threads=writer_threads, jsonl_path=os.path.join(state_dir, f'results-{node}.jsonl'),
+                                   json_indent=None, append=True)
+        self.journal = Journal(state_dir, node)
+        self.processed = 0
+        self.errors = 0
+
+    def process(self, items, heartbeat=None):
+        """Process items and checkpoint them once their results are on disk."""
+        entries = []
+        for item in items:
+            img = cv2.imread(os.path.join(self.root, item))
+            if img is None:
+                entries.append({'item': item, 'status': 'error', 'error': 'failed to read image'})
+                self.errors += 1
+            else:
+                data = detector.detect_positions(img, self.profile, self.preprocessor)
+                self.writer.write_json(item, data, image=item)
+                entries.append({'item': item, 'status': 'ok'})
+            self.processed += 1
+            if heartbeat is not None:
+                heartbeat()
+        # Results first, journal second: a crash in between only causes rework, never loss
+        self.writer.flush(sync=True)
+        self.journal.record(entries)
+
+    def close(self):
+        try:
+            self.writer.close()
+        finally:
+            self.journal.close()
+
+
+def run_shard(runner, items, done, shard, checkpoint_every):
+    index, count = shard
+    todo = [it for it in items if shard_of(it, count) == index and it not in done]
+    print(f"Shard {index}/{count}: {len(todo)} item(s) to process")
+    for start in range(0, len(todo), checkpoint_every):
+        runner.process(todo[start:start + checkpoint_every])
+        print(f"  {min(start + checkpoint_every, len(todo))}/{len(todo)} done")
+
+
+def run_leases(runner, items, done, leases, chunk_size, poll):
+    chunks = list(range((len(items) + chunk_size - 1) // chunk_size))
+    while True:
+        remaining = [c for c in chunks if not leases.is_done(c)]
+        if not remaining:
+            break
+        progressed = False
+        for chunk in remaining:
+            if not leases.acquire(chunk):
+                continue
+            progressed = True
+            todo = [it for it in items[chunk * chunk_size:(chunk + 1) * chunk_size] if it not in done]
+            runner.process(todo, heartbeat=lambda c=chunk: leases.heartbeat(c))
+            done.update((it, 'ok') for it in todo)
+            leases.complete(chunk)
+            print(f"  chunk {chunk}: {len(todo)} item(s) done")
+        if not progressed:
+            # Everything left is leased by live nodes; wait in case one of them dies
+            time.sleep(poll)
+
+
+def spawn_local_nodes(args, count):
+    """
+    Run `count` copies of this command as separate local processes standing in for nodes
+
+    Unless --cv-threads is given, each node gets an equal share of the CPU cores
+    (preprocess.worker_threads) instead of OpenCV's default of one thread per core.
+    """
+    base = [sys.executable, os.path.abspath(__file__), 'run', args.input, '--state-dir', args.state_dir]
+    cv_threads = args.cv_threads if args.cv_threads is not None else worker_threads(count)
+    for opt, value in (('--profile', args.profile), ('--profile-name', args.profile_name),
+                       ('--cv-threads', cv_threads), ('--writer-threads', args.writer_threads)):
+        if value is not None:
+            base += [opt, str(value)]
+    if args.lease:
+        base += ['--lease', '--chunk-size', str(args.chunk_size), '--lease-timeout', str(args.lease_timeout)]
+    else:
+        base += ['--checkpoint-every', str(args.checkpoint_every)]
+    procs = []
+    for k in range(count):
+        cmd = base + ['--node', f'local-{k}']
+        if not args.lease:
+            cmd += ['--shard', f'{k}/{count}']
+        procs.append(subprocess.Popen(cmd))
+    return max(p.wait() for p in procs)
+
+
+def cmd_run(args):
+    os.makedirs(args.state_dir, exist_ok=True)
+    if args.local_nodes:
+        sys.exit(spawn_local_nodes(args, args.local_nodes))
+    if (args.shard is None) == (not args.lease):
+        print('Choose exactly one of --shard i/N or --lease (or use --local-nodes).')
+        sys.exit(2)
+
+    try:
+        profile_data = load_profile(args.profile, args.profile_name)
+    except (OSError, ValueError) as e:
+        print('Failed to load detector profile:', e)
+        sys.exit(2)
+    profile = compile_profile(profile_data)
+    configure_threads(args.cv_threads, profile['opencl'])
+
+    node = args.node or f'{socket.gethostname()}-{os.getpid()}'
+    items = load_manifest(args.input, args.state_dir)
+    done = read_journals(args.state_dir)
+    print(f"Node {node}: {len(items)} item(s) in manifest, {sum(1 for it in items if it in done)} already done")
+
+    writer_threads = args.writer_threads if args.writer_threads is not None else profile['output']['writer_threads']
+    runner = BatchRunner(args.input, args.state_dir, node, profile, writer_threads)
+    t0 = time.perf_counter()
+    try:
+        if args.lease:
+            leases = LeaseManager(args.state_dir, node, args.lease_timeout)
+            run_leases(runner, items, done, leases, args.chunk_size, args.poll)
+        else:
+            run_shard(runner, items, done, args.shard, args.checkpoint_every)
+    finally:
+        runner.close()
+    elapsed = time.perf_counter() - t0
+    rate = runner.processed / elapsed if elapsed > 0 else 0.0
+    print(f"Node {node}: processed {runner.processed} item(s) ({runner.errors} error(s)) in {elapsed:.1f}s, {rate:.1f} img/s")
+
+
+def cmd_status(args):
+    manifest = os.path.join(args.state_dir, 'manifest.txt')
+    if not os.path.isfile(manifest):
+        print(f"No manifest in '{args.state_dir}'")
+        sys.exit(2)
+    with open(manifest, 'r', encoding='utf-8') as f:
+        items = [line.rstrip('\n') for line in f if line.strip()]
+    done = read_journals(args.state_dir)
+    ok = sum(1 for it in items if done.get(it) == 'ok')
+    errors = sum(1 for it in items if done.get(it) == 'error')
+    print(f"Items: {len(items)}  ok: {ok}  error: {errors}  remaining: {len(items) - ok - errors}")
+    leases = glob.glob(os.path.join(args.state_dir, 'leases', '*.lease'))
+    if leases:
+        print(f"Active leases: {len(leases)}")
+
+
+def cmd_merge(args):
+    """Merge all results-*.jsonl into one file, one record per image (sorted)."""
+    records = {}
+    for fp in sorted(glob.glob(os.path.join(args.state_dir, 'results-*.jsonl'))):
+        with open(fp, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                # Items redone after a crash appear twice; both results are equivalent
+                records[record['image']] = record
+    done = read_journals(args.state_dir)
+    # Only keep results whose item was checkpointed, i.e. fully written before the journal entry
+    merged = [records[k] for k in sorted(records) if done.get(k) == 'ok']
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for record in merged:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+    print(f"Merged {len(merged)} record(s) into {args.output}")
+    manifest = os.path.join(args.state_dir, 'manifest.txt')
+    if os.path.isfile(manifest):
+        with open(manifest, 'r', encoding='utf-8') as f:
+            total = sum(1 for line in f if line.strip())
+        errors = sum(1 for status in done.values() if status == 'error')
+        missing = total - len(merged) - errors
+        if missing or errors:
+            print(f"Warning: {missing} item(s) not finished yet, {errors} item(s) failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded, resumable batch detection over a large image tree')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='Process images as one node (or several local nodes)')
+    run.add_argument('input', help='Root directory of the input image tree')
+    run.add_argument('--state-dir', '-s', required=True, help='Shared directory for manifest, leases, journals and results')
+    run.add_argument('--shard', type=parse_shard, help='Process the deterministic shard i of N, e.g. 0/4')
+    run.add_argument('--lease', action='store_true', help='Claim chunks dynamically through lock-file leases')
+    run.add_argument('--chunk-size', type=int, default=256, help='Items per leased chunk (default 256)')
+    run.add_argument('--lease-timeout', type=float, default=600.0, help='Seconds without heartbeat before a lease expires (default 600)')
+    run.add_argument('--poll', type=float, default=5.0, help='Seconds between retries when all chunks are leased (default 5)')
+    run.add_argument('--checkpoint-every', type=int, default=100, help='Items between checkpoints in shard mode (default 100)')
+    run.add_argument('--node', help='Node name (default: hostname-pid)')
+    run.add_argument('--local-nodes', type=int, help='Start this many local processes as nodes (shards unless --lease)')
+    run.add_argument('--profile', '-P', help='Detector profile (JSON/YAML) or sweep.py output')
+    run.add_argument('--profile-name', help='Pareto front entry when --profile is a sweep.py output')
+    run.add_argument('--cv-threads', type=int, help='OpenCV threads for this node')
+    run.add_argument('--writer-threads', type=int, help="Background writer threads (default: the profile's)")
+    run.set_defaults(func=cmd_run)
+
+    status = sub.add_parser('status', help='Show progress of a run')
+    status.add_argument('--state-dir', '-s', required=True, help='State directory of the run')
+    status.set_defaults(func=cmd_status)
+
+    merge = sub.add_parser('merge', help='Merge per-node results into one JSON Lines file')
+    merge.add_argument('--state-dir', '-s', required=True, help='State directory of the run')
+    merge.add_argument('--output', '-o', default='merged.jsonl', help='Merged JSON Lines file (default merged.jsonl)')
+    merge.set_defaults(func=cmd_merge)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the detection preprocessing stage
+- Allocation churn: bytes allocated per frame by the original split/np.maximum path vs. preprocess.Preprocessor
+- Per-frame preprocessing time for both paths
+- Multi-worker scaling of the full detector with OpenCV's default threading vs. the per-worker thread policy
+
+Usage:
+  python3 bench_preprocess.py                       # synthetic 1920x1080 frames
+  python3 bench_preprocess.py --images input --frames 200 --workers 1 2 4
+
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import main as detector
+from evaluate import list_images
+from preprocess import Preprocessor, configure_threads, worker_threads
+from profiles import compile_profile, load_profile
+
+_frames = []
+_profile = None
+
+
+def legacy_planes(img):
+    """The preprocessing main.detect_circles used before Preprocessor."""
+    b, g, r = cv2.split(img)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    combined = np.maximum(np.maximum(r, g), b)
+    return gray, combined
+
+
+def load_frames(images_dir, count, size):
+    if images_dir:
+        files = sorted(list_images(images_dir).values())[:count]
+        frames = [cv2.imread(fp) for fp in files]
+        return [f for f in frames if f is not None]
+    # Synthetic table: felt background, a few colored balls and mild sensor noise
+    w, h = size
+    rng = np.random.default_rng(0)
+    frames = []
+    for _ in range(min(count, 8)):
+        img = np.full((h, w, 3), (40, 110, 40), dtype=np.uint8)
+        for _ in range(15):
+            center = (int(rng.integers(40, w - 40)), int(rng.integers(40, h - 40)))
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            cv2.circle(img, center, 11, color, -1)
+        noise = rng.integers(0, 8, (h, w, 3), dtype=np.uint8)
+        frames.append(cv2.add(img, noise))
+    return frames
+
+
+def measure_allocations(fn, frames, repeat):
+    """Return (mean ms per frame, mean bytes allocated per frame)."""
+    fn(frames[0])
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    allocated = 0
+    t0 = time.perf_counter()
+    for i in range(repeat):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn(frames[i % len(frames)])
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    elapsed = time.perf_counter() - t0
+    tracemalloc.stop()
+    return elapsed * 1000.0 / repeat, allocated / repeat
+
+
+def init_worker(frames, profile, threads):
+    global _frames, _profile
+    if threads is not None:
+        configure_threads(threads)
+    _frames = frames
+    _profile = profile
+
+
+def detect_batch(indices):
+    """Worker: run the full detector on a batch of cached frames."""
+    pre = Preprocessor(_profile)
+    for i in indices:
+        img = _frames[i % len(_frames)]
+        detector.find_balls(img, _profile, pre.planes(img))
+    return len(indices)
+
+
+def throughput(frames, profile, workers, total, threads):
+    """Frames per second for `total` detections over `workers` processes."""
+    batches = [list(range(i, min(i + 8, total))) for i in range(0, total, 8)]
+    ctx = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else multiprocessing.get_context()
+    with ctx.Pool(workers, initializer=init_worker, initargs=(frames, profile, threads)) as pool:
+        pool.map(detect_batch, batches[:workers])  # warm-up
+        t0 = time.perf_counter()
+        done = sum(pool.map(detect_batch, batches))
+        elapsed = time.perf_counter() - t0
+    return done / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark detection preprocessing and multi-worker scaling')
+    parser.add_argument('--images', '-i', help='Directory of images (default: synthetic frames)')
+    parser.add_argument('--size', default='1920x1080', help='Synthetic frame size WxH (default 1920x1080)')
+    parser.add_argument('--frames', '-n', type=int, default=100, help='Frames per measurement (default 100)')
+    parser.add_argument('--workers', '-w', type=int, nargs='+', help='Worker counts to test (default: 1, 2, 4, ... up to CPU count)')
+    parser.add_argument('--profile', '-P', help='Detector profile (default: built-in profile)')
+
+    args = parser.parse_args()
+
+    w, h = (int(v) for v in args.size.lower().split('x'))
+    frames = load_frames(args.images, args.frames, (w, h))
+    if not frames:
+        print('No frames to benchmark.')
+        return
+    profile = compile_profile(load_profile(args.profile), calibration=(None, None))
+    fh, fw = frames[0].shape[:2]
+    print(f"Frames: {len(frames)} distinct, {fw}x{fh}, CPU cores: {os.cpu_count()}, OpenCL available: {cv2.ocl.haveOpenCL()}")
+    print('=' * 60)
+
+    pre = Preprocessor(profile, use_umat=False)
+    rows = [('legacy split/np.maximum', legacy_planes), ('Preprocessor (buffers)', pre.planes)]
+    if cv2.ocl.haveOpenCL():
+        configure_threads(opencl=True)
+        rows.append(('Preprocessor (UMat)', Preprocessor(profile, use_umat=True).planes))
+    print(f"{'Preprocessing':<26} {'ms/frame':>9} {'KiB alloc/frame':>16}")
+    for name, fn in rows:
+        ms, allocated = measure_allocations(fn, frames, args.frames)
+        print(f"{name:<26} {ms:>9.3f} {allocated / 1024:>16.1f}")
+    configure_threads(opencl=False)
+
+    cpus = os.cpu_count() or 1
+    worker_counts = args.workers or sorted({1, *[2 ** k for k in range(1, 8) if 2 ** k <= cpus], cpus})
+    print('=' * 60)
+    print(f"{'Workers':>7} {'default threads fps':>20} {'policy threads':>15} {'policy fps':>11}")
+    for workers in worker_counts:
+        default_fps = throughput(frames, profile, workers, args.frames, None)
+        threads = worker_threads(workers)
+        policy_fps = throughput(frames, profile, workers, args.frames, threads)
+        print(f"{workers:>7} {default_fps:>20.1f} {threads:>15} {policy_fps:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
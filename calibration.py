@@ -0,0 +1,202 @@
+import cv2
+import numpy as np
+import hashlib
+import json
+import os
+
+TABLE_CORNERS_FILE = "table_corners.json"
+
+def load_table_transform(tc_file=TABLE_CORNERS_FILE):
+    """
+    Đọc file góc bàn và tính ma trận perspective sang hệ tọa độ bàn
+
+    Args:
+        tc_file: Đường dẫn file JSON chứa "table_corners"
+
+    Returns:
+        tuple: (transform_M, table_size) hoặc (None, None) nếu không đọc được
+    """
+    try:
+        with open(tc_file, 'r', encoding='utf-8') as f:
+            tc = json.load(f)
+            # Expecting structure { "table_corners": [[x1,y1],[x2,y2],[x3,y3],[x4,y4]] }
+            if 'table_corners' in tc and len(tc['table_corners']) == 4:
+                table_corners = np.array(tc['table_corners'], dtype=np.float32)
+                # We'll map these to a rectangular table coordinate system with origin at top-left
+                # Compute width and height from corners (take max of opposing edges)
+                widthA = np.linalg.norm(table_corners[1] - table_corners[0])
+                widthB = np.linalg.norm(table_corners[2] - table_corners[3])
+                maxWidth = int(max(widthA, widthB))
+
+                heightA = np.linalg.norm(table_corners[3] - table_corners[0])
+                heightB = np.linalg.norm(table_corners[2] - table_corners[1])
+                maxHeight = int(max(heightA, heightB))
+
+                table_size = (maxWidth, maxHeight)
+
+                dst = np.array([[0, 0], [maxWidth - 1, 0], [maxWidth - 1, maxHeight - 1], [0, maxHeight - 1]], dtype=np.float32)
+                transform_M = cv2.getPerspectiveTransform(table_corners, dst)
+                return transform_M, table_size
+            else:
+                print(f"Warning: '{tc_file}' not in expected format. Falling back to image coordinates.")
+    except FileNotFoundError:
+        print(f"Warning: '{tc_file}' not found. Falling back to image coordinates.")
+    except Exception as e:
+        print(f"Warning: failed to load '{tc_file}': {e}. Falling back to image coordinates.")
+    return None, None
+
+# Tên 6 lỗ theo thứ tự trả về của pocket_targets
+POCKET_NAMES = ['top-left', 'top-middle', 'top-right', 'bottom-left', 'bottom-middle', 'bottom-right']
+
+# Vị trí lỗ đã tìm, theo khóa calibration (dùng lại cho mọi frame trong tiến trình)
+_pocket_cache = {}
+
+def pocket_targets(table_size):
+    """
+    Vị trí danh nghĩa của 6 lỗ trong hệ tọa độ bàn: 4 góc và giữa 2 cạnh dài
+
+    Returns:
+        list: [(x, y), ...] theo thứ tự POCKET_NAMES (với bàn dọc, "top"/"bottom" là cạnh trái/phải)
+    """
+    w, h = table_size[0] - 1, table_size[1] - 1
+    if table_size[0] >= table_size[1]:
+        return [(0, 0), (w / 2, 0), (w, 0), (0, h), (w / 2, h), (w, h)]
+    return [(0, 0), (0, h / 2), (0, h), (w, 0), (w, h / 2), (w, h)]
+
+def _find_pocket_in_roi(roi, config):
+    """
+    Tìm lỗ trong một vùng ảnh xám nhỏ: HoughCircles bán kính nhỏ, nếu không có thì lấy vùng tối nhất
+
+    Returns:
+        tuple: (x, y, radius) trong tọa độ ROI, hoặc None
+    """
+    blurred = cv2.GaussianBlur(roi, (5, 5), 0)
+    circles = cv2.HoughCircles(blurred, cv2.HOUGH_GRADIENT, dp=1.0, minDist=max(roi.shape),
+                               param1=100, param2=12,
+                               minRadius=config['min_radius'], maxRadius=config['max_radius'])
+    best = None
+    if circles is not None:
+        for cx, cy, r in circles[0, :]:
+            mask = np.zeros(roi.shape, dtype=np.uint8)
+            cv2.circle(mask, (int(round(cx)), int(round(cy))), max(1, int(r * 0.7)), 255, -1)
+            mean = cv2.mean(roi, mask=mask)[0]
+            if mean <= config['max_intensity'] and (best is None or mean < best[3]):
+                best = (float(cx), float(cy), float(r), mean)
+    if best is not None:
+        return best[:3]
+
+    # Fallback: tâm vùng tối nhất sau khi làm mờ theo cỡ lỗ nhỏ nhất
+    k = 2 * config['min_radius'] + 1
+    dark = cv2.blur(roi, (k, k))
+    min_val, _, min_loc, _ = cv2.minMaxLoc(dark)
+    if min_val <= config['max_intensity']:
+        return float(min_loc[0]), float(min_loc[1]), float(config['min_radius'])
+    return None
+
+def detect_pockets(gray, transform_M, table_size, config):
+    """
+    Tìm 6 lỗ bàn trong ảnh xám, chỉ tìm quanh vị trí danh nghĩa suy ra từ góc bàn
+
+    Args:
+        gray: Ảnh xám
+        transform_M: Ma trận perspective ảnh -> bàn
+        table_size: (width, height) của bàn
+        config: Section "pockets" của profile
+
+    Returns:
+        list: Mỗi lỗ {"name", "x", "y", "x_norm", "y_norm", "image_x", "image_y", "radius", "detected"}
+    """
+    inv_M = np.linalg.inv(transform_M)
+    targets = np.array([pocket_targets(table_size)], dtype=np.float32)
+    image_targets = cv2.perspectiveTransform(targets, inv_M)[0]
+
+    # Bán kính vùng tìm kiếm tính theo đường chéo bàn trong ảnh
+    w, h = table_size
+    diag_pts = cv2.perspectiveTransform(np.array([[[0, 0], [w - 1, h - 1]]], dtype=np.float32), inv_M)[0]
+    search = max(config['max_radius'] + 2, int(config['search_radius'] * np.linalg.norm(diag_pts[1] - diag_pts[0])))
+
+    pockets = []
+    for name, (ix, iy) in zip(POCKET_NAMES, image_targets):
+        x0 = max(0, int(ix) - search)
+        y0 = max(0, int(iy) - search)
+        x1 = min(gray.shape[1], int(ix) + search + 1)
+        y1 = min(gray.shape[0], int(iy) + search + 1)
+        found = None
+        if x1 - x0 > 2 * config['min_radius'] and y1 - y0 > 2 * config['min_radius']:
+            found = _find_pocket_in_roi(gray[y0:y1, x0:x1], config)
+        if found is not None:
+            px, py, radius = x0 + found[0], y0 + found[1], found[2]
+        else:
+            # Không tìm thấy: giữ vị trí danh nghĩa để output luôn đủ 6 lỗ
+            px, py, radius = float(ix), float(iy), 0.0
+        tx, ty = cv2.perspectiveTransform(np.array([[[px, py]]], dtype=np.float32), transform_M)[0][0]
+        pockets.append({
+            'name': name,
+            'x': int(tx),
+            'y': int(ty),
+            'x_norm': round(float(tx) / w, 6) if w > 0 else 0.0,
+            'y_norm': round(float(ty) / h, 6) if h > 0 else 0.0,
+            'image_x': int(round(px)),
+            'image_y': int(round(py)),
+            'radius': int(round(radius)),
+            'detected': found is not None,
+        })
+    return pockets
+
+def calibration_key(transform_M, image_shape):
+    """Khóa ổn định của một calibration (ma trận perspective + kích thước ảnh) cho các cache."""
+    digest = hashlib.sha1(np.round(transform_M, 6).tobytes())
+    digest.update(f"{image_shape[1]}x{image_shape[0]}".encode())
+    return digest.hexdigest()
+
+def _pocket_key(transform_M, image_shape, config):
+    # Thay đổi tham số tìm lỗ (trừ enabled/cache) cũng làm mất hiệu lực cache
+    params = {k: v for k, v in config.items() if k not in ('enabled', 'cache')}
+    digest = hashlib.sha1(calibration_key(transform_M, image_shape).encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def get_pockets(gray, tc_file, transform_M, table_size, config):
+    """
+    Vị trí 6 lỗ cho calibration hiện tại; chỉ tìm một lần rồi dùng lại
+
+    Kết quả được giữ trong bộ nhớ và (nếu config["cache"]) ghi vào file góc bàn dưới
+    khóa "pockets", để các lần chạy sau và các tiến trình khác không phải tìm lại.
+    Cache tự mất hiệu lực khi góc bàn, kích thước ảnh hoặc tham số tìm lỗ thay đổi.
+
+    Returns:
+        list: Như detect_pockets, hoặc None nếu không có calibration
+    """
+    if transform_M is None or table_size is None:
+        return None
+    key = _pocket_key(transform_M, gray.shape, config)
+    if key in _pocket_cache:
+        return _pocket_cache[key]
+
+    pockets = None
+    data = None
+    if config['cache']:
+        try:
+            with open(tc_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            cached = data.get('pockets')
+            if isinstance(cached, dict) and cached.get('key') == key:
+                pockets = cached['pockets']
+        except (OSError, ValueError):
+            data = None
+
+    if pockets is None:
+        pockets = detect_pockets(gray, transform_M, table_size, config)
+        if config['cache'] and data is not None:
+            data['pockets'] = {'key': key, 'pockets': pockets}
+            # Ghi qua file tạm rồi đổi tên để các tiến trình đọc song song không thấy file dở dang
+            tmp_file = f"{tc_file}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2)
+                os.replace(tmp_file, tc_file)
+            except OSError as e:
+                print(f"Warning: could not cache pockets in '{tc_file}': {e}")
+
+    _pocket_cache[key] = pockets
+    return pockets
@@ -116,12 +116,63 @@ def apply_flip_to_norms(balls, mode):
     return flipped
 
 
+def print_best(best, tol):
+    if best and best['pattern']:
+        print(f"Best candidate: {best['pattern']} (mode={best['mode']}) with {best['count']} mismatches")
+        detail = best['detail']
+        if isinstance(detail, str):
+            print('Reason:', detail)
+        else:
+            print('Mismatches:')
+            for m in detail:
+                i = m['index']
+                s = m['shot']
+                p = m['pattern']
+                print(f"#{i}: shot number={s.get('number')} pattern number={p.get('number')}")
+                print(f"  shot x_norm={s['x_norm']:.6f} y_norm={s['y_norm']:.6f}")
+                print(f"  pat  x_norm={p['x_norm']:.6f} y_norm={p['y_norm']:.6f}")
+                print(f"  dx={m['dx']:.6f} dy={m['dy']:.6f} (tol={tol})")
+
+
+def match_library(args, shot):
+    """Match the shot against a pattern library index; returns the exit code."""
+    # Imported here: pattern_library itself builds on this module
+    from pattern_library import load_library, query, stale_files
+
+    try:
+        library = load_library(args.index)
+    except (OSError, ValueError) as e:
+        print('Failed to load pattern library:', e)
+        return 2
+    stale = stale_files(library)
+    if stale:
+        print(f"Warning: {len(stale)} pattern file(s) changed since '{args.index}' was built; "
+              "rebuild it with pattern_library.py build")
+
+    matches, best, stats = query(library, shot, tol=args.tol)
+    print(f"Checked {stats['representatives']} cluster representative(s), "
+          f"compared {stats['compared']} of {stats['total']} pattern file(s)")
+    if matches:
+        print('MATCH found:')
+        for m in matches:
+            print(f"  pattern: {m['pattern']}  flip: {m['mode']}")
+            if m['duplicates']:
+                print(f"    duplicates: {', '.join(m['duplicates'])}")
+        return 0
+    print('NO MATCH found in pattern library.')
+    if best is None:
+        print(f"No pattern with {len(shot)} balls in the library.")
+    print_best(best, args.tol)
+    return 1
+
+
 def main():
     parser = argparse.ArgumentParser(description='Compare shot and pattern position JSON files using normalized coordinates')
     parser.add_argument('shot', help='Shot JSON file')
     parser.add_argument('--patterns-dir', '-p', default='patterns/position', help='Directory containing pattern JSON files (default: patterns/positions)')
     parser.add_argument('--tol', type=float, default=TOL, help='Tolerance for x_norm and y_norm (default 0.025)')
     parser.add_argument('--order', action='store_true', help='Sort balls by number before comparison (default: compare in original JSON order)')
+    parser.add_argument('--index', '-x', help='Pattern library built by pattern_library.py; checks cluster representatives first (implies --order)')
 
     args = parser.parse_args()
 
@@ -131,6 +182,9 @@ def main():
         print('Failed to load shot file:', e)
         sys.exit(2)
 
+    if args.index:
+        sys.exit(match_library(args, shot))
+
     # Gather pattern files
     patterns_dir = args.patterns_dir
     pattern_files = sorted(glob.glob(os.path.join(patterns_dir, '*.json')))
@@ -188,21 +242,7 @@ def main():
         sys.exit(0)
     else:
         print('NO MATCH found in patterns directory.')
-        if best['pattern']:
-            print(f"Best candidate: {best['pattern']} (mode={best['mode']}) with {best['count']} mismatches")
-            detail = best['detail']
-            if isinstance(detail, str):
-                print('Reason:', detail)
-            else:
-                print('Mismatches:')
-                for m in detail:
-                    i = m['index']
-                    s = m['shot']
-                    p = m['pattern']
-                    print(f"#{i}: shot number={s.get('number')} pattern number={p.get('number')}")
-                    print(f"  shot x_norm={s['x_norm']:.6f} y_norm={s['y_norm']:.6f}")
-                    print(f"  pat  x_norm={p['x_norm']:.6f} y_norm={p['y_norm']:.6f}")
-                    print(f"  dx={m['dx']:.6f} dy={m['dy']:.6f} (tol={args.tol})")
+        print_best(best, args.tol)
         sys.exit(1)
 
 
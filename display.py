@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+
+# Kích thước hiển thị tối đa mặc định (width, height) cho các công cụ chọn điểm
+DEFAULT_MAX_SIZE = (1600, 900)
+
+def parse_size(text):
+    """'WxH' -> (W, H)"""
+    w, h = (int(v) for v in text.lower().split('x'))
+    return w, h
+
+class DisplayPyramid:
+    """
+    Ảnh hiển thị thu nhỏ (pyrDown) cho ảnh độ phân giải cao, tính một lần và dùng lại
+
+    - Mức mặc định là mức lớn nhất vừa với `max_size`; đổi mức bằng zoom_in()/zoom_out()
+      (mỗi mức chỉ được tính ở lần dùng đầu tiên)
+    - Tọa độ chuột ở mức hiển thị được đổi về tọa độ ảnh gốc bằng to_image(),
+      và ngược lại bằng to_display()
+    - canvas() chép mức hiện tại vào bộ đệm cố định để vẽ chú thích, không cấp phát mảng mới
+    """
+
+    def __init__(self, img, max_size=DEFAULT_MAX_SIZE):
+        self.levels = [img]
+        self.level = 0
+        max_w, max_h = max_size
+        while True:
+            h, w = self.levels[self.level].shape[:2]
+            if (w <= max_w and h <= max_h) or min(w, h) < 2:
+                break
+            self.level += 1
+            self._get(self.level)
+        self._canvas = None
+
+    def _get(self, level):
+        while len(self.levels) <= level:
+            self.levels.append(cv2.pyrDown(self.levels[-1]))
+        return self.levels[level]
+
+    @property
+    def image(self):
+        return self._get(self.level)
+
+    @property
+    def scale(self):
+        """(sx, sy): kích thước mức hiển thị / kích thước ảnh gốc."""
+        h0, w0 = self.levels[0].shape[:2]
+        h, w = self.image.shape[:2]
+        return w / w0, h / h0
+
+    def zoom_in(self):
+        """Lên mức chi tiết hơn; trả về True nếu mức thay đổi."""
+        if self.level == 0:
+            return False
+        self.level -= 1
+        return True
+
+    def zoom_out(self):
+        """Xuống mức nhỏ hơn; trả về True nếu mức thay đổi."""
+        h, w = self.image.shape[:2]
+        if min(w, h) < 64:
+            return False
+        self.level += 1
+        self._get(self.level)
+        return True
+
+    def to_image(self, x, y):
+        sx, sy = self.scale
+        return int(round(x / sx)), int(round(y / sy))
+
+    def to_display(self, x, y):
+        sx, sy = self.scale
+        return int(round(x * sx)), int(round(y * sy))
+
+    def canvas(self):
+        """Bản sao mức hiện tại trong bộ đệm dùng lại, để vẽ chú thích lên."""
+        img = self.image
+        if self._canvas is None or self._canvas.shape != img.shape:
+            self._canvas = np.empty_like(img)
+        np.copyto(self._canvas, img)
+        return self._canvas
+
+def window_closed(name):
+    """True nếu người dùng đã đóng cửa sổ bằng nút X."""
+    try:
+        return cv2.getWindowProperty(name, cv2.WND_PROP_VISIBLE) < 1
+    except cv2.error:
+        return True
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Evaluation harness: score detector output against hand-labeled positions
+- Pair each labeled JSON (from positions-selector.py) with an image (or an existing detector JSON) by file name
+- Run the main.py detector on every image in parallel worker processes and time each frame
+- Match detected to labeled balls within tolerance (same per-axis tol as compare_positions.py)
+- Report precision/recall, classification accuracy per ball number and position error in normalized table units
+- Optionally append the run to a report file so several detector configurations can be compared side by side
+
+Usage:
+  python3 evaluate.py --images input --labels labels --workers 4 --name baseline --report eval_report.json
+  python3 evaluate.py --images input --labels labels --profile sweep.json --profile-name pareto-1 --report eval_report.json
+  python3 evaluate.py --detections output/position --labels labels
+
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import main as detector
+from calibration import load_table_transform
+from compare_positions import TOL, load_positions
+from preprocess import Preprocessor, configure_threads, worker_threads
+from profiles import compile_profile, load_profile
+
+IMAGE_EXTENSIONS = ['*.png', '*.jpg', '*.jpeg', '*.bmp', '*.tiff']
+
+# Per-worker state, filled by init_worker
+_worker_profile = None
+_worker_preprocessor = None
+_worker_tol = TOL
+
+
+def list_images(folder):
+    """Return image files in `folder` keyed by file stem."""
+    files = {}
+    for extension in IMAGE_EXTENSIONS:
+        for pattern in (extension, extension.upper()):
+            for fp in glob.glob(os.path.join(folder, pattern)):
+                files[os.path.splitext(os.path.basename(fp))[0]] = fp
+    return files
+
+
+def find_pairs(labels_dir, images_dir=None, detections_dir=None):
+    """Pair every label JSON with the image (or detection JSON) that has the same stem."""
+    if images_dir is not None:
+        sources = list_images(images_dir)
+    else:
+        sources = {os.path.splitext(os.path.basename(fp))[0]: fp
+                   for fp in glob.glob(os.path.join(detections_dir, '*.json'))}
+    pairs = []
+    missing = []
+    for label_fp in sorted(glob.glob(os.path.join(labels_dir, '*.json'))):
+        stem = os.path.splitext(os.path.basename(label_fp))[0]
+        if stem in sources:
+            pairs.append((stem, sources[stem], label_fp))
+        else:
+            missing.append(stem)
+    return pairs, missing
+
+
+def ball_number(b):
+    num = b.get('number')
+    if isinstance(num, str) and num.isdigit():
+        return int(num)
+    return num
+
+
+def match_balls(detected, labeled, tol=TOL):
+    """
+    Greedily match detected to labeled balls by normalized distance.
+
+    A pair is eligible only if both |dx| and |dy| are within `tol`, the same rule
+    compare_positions.py uses. Closest pairs are matched first.
+
+    Returns:
+        tuple: (matches, unmatched_detected, unmatched_labeled) where matches is a
+        list of (detected_ball, labeled_ball, dx, dy, dist)
+    """
+    candidates = []
+    for i, d in enumerate(detected):
+        for j, l in enumerate(labeled):
+            dx = d['x_norm'] - l['x_norm']
+            dy = d['y_norm'] - l['y_norm']
+            if abs(dx) <= tol and abs(dy) <= tol:
+                candidates.append((float(np.hypot(dx, dy)), i, j, dx, dy))
+    candidates.sort(key=lambda c: c[0])
+
+    used_d = set()
+    used_l = set()
+    matches = []
+    for dist, i, j, dx, dy in candidates:
+        if i in used_d or j in used_l:
+            continue
+        used_d.add(i)
+        used_l.add(j)
+        matches.append((detected[i], labeled[j], dx, dy, dist))
+    unmatched_d = [d for i, d in enumerate(detected) if i not in used_d]
+    unmatched_l = [l for j, l in enumerate(labeled) if j not in used_l]
+    return matches, unmatched_d, unmatched_l
+
+
+def score_frame(stem, detected, labeled, tol=TOL):
+    """Score one frame and return a JSON-serializable record."""
+    matches, unmatched_d, unmatched_l = match_balls(detected, labeled, tol)
+    return {
+        'frame': stem,
+        'tp': len(matches),
+        'fp': len(unmatched_d),
+        'fn': len(unmatched_l),
+        'matches': [{
+            'label_number': ball_number(l),
+            'detected_number': ball_number(d),
+            'dx': round(dx, 6),
+            'dy': round(dy, 6),
+            'error': round(dist, 6)
+        } for d, l, dx, dy, dist in matches],
+        'missed': [ball_number(l) for l in unmatched_l],
+        'spurious': [ball_number(d) for d in unmatched_d],
+    }
+
+
+def filter_balls(balls):
+    """Keep balls 1-15, the same set compare_positions.py scores."""
+    kept = []
+    for b in balls:
+        num = ball_number(b)
+        if isinstance(num, int) and 1 <= num <= 15:
+            kept.append(b)
+    return kept
+
+
+def init_worker(profile, tol, threads=None):
+    global _worker_profile, _worker_preprocessor, _worker_tol
+    _worker_profile = profile
+    _worker_tol = tol
+    if profile is not None:
+        configure_threads(threads, profile['opencl'])
+        _worker_preprocessor = Preprocessor(profile)
+
+
+def evaluate_image(task):
+    """Worker: decode, detect and score a single image."""
+    stem, image_path, label_path = task
+    labeled, _ = load_positions(label_path)
+
+    t0 = time.perf_counter()
+    img = cv2.imread(image_path)
+    t1 = time.perf_counter()
+    if img is None:
+        return {'frame': stem, 'error': f'failed to read image {image_path}'}
+    p = _worker_profile
+    detected_balls = detector.find_balls(img, p, _worker_preprocessor.planes(img))
+    positions = detector.build_positions(detected_balls, p['transform_M'], p['table_size'], img.shape)
+    t2 = time.perf_counter()
+
+    record = score_frame(stem, filter_balls(positions['balls']), labeled, _worker_tol)
+    record['decode_ms'] = round((t1 - t0) * 1000.0, 3)
+    record['detect_ms'] = round((t2 - t1) * 1000.0, 3)
+    return record
+
+
+def evaluate_detection_file(task):
+    """Worker: score an existing detector JSON (no timing available)."""
+    stem, detection_path, label_path = task
+    labeled, _ = load_positions(label_path)
+    detected, _ = load_positions(detection_path)
+    return score_frame(stem, detected, labeled, _worker_tol)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def summarize(records):
+    """Aggregate per-frame records into one summary dict."""
+    frames = [r for r in records if 'error' not in r]
+    tp = sum(r['tp'] for r in frames)
+    fp = sum(r['fp'] for r in frames)
+    fn = sum(r['fn'] for r in frames)
+    precision = tp / (tp + fp) if tp + fp > 0 else 0.0
+    recall = tp / (tp + fn) if tp + fn > 0 else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+
+    errors = []
+    correct = 0
+    per_number = {}
+    for r in frames:
+        for m in r['matches']:
+            errors.append(m['error'])
+            stats = per_number.setdefault(str(m['label_number']), {'labeled': 0, 'matched': 0, 'correct': 0})
+            stats['labeled'] += 1
+            stats['matched'] += 1
+            if m['detected_number'] == m['label_number']:
+                stats['correct'] += 1
+                correct += 1
+        for num in r['missed']:
+            stats = per_number.setdefault(str(num), {'labeled': 0, 'matched': 0, 'correct': 0})
+            stats['labeled'] += 1
+    for stats in per_number.values():
+        stats['recall'] = round(stats['matched'] / stats['labeled'], 4) if stats['labeled'] else 0.0
+        stats['accuracy'] = round(stats['correct'] / stats['matched'], 4) if stats['matched'] else 0.0
+
+    summary = {
+        'frames': len(frames),
+        'failed_frames': len(records) - len(frames),
+        'tp': tp,
+        'fp': fp,
+        'fn': fn,
+        'precision': round(precision, 4),
+        'recall': round(recall, 4),
+        'f1': round(f1, 4),
+        'classification_accuracy': round(correct / tp, 4) if tp else 0.0,
+        'position_error': {
+            'mean': round(float(np.mean(errors)), 6) if errors else 0.0,
+            'median': round(percentile(errors, 50), 6),
+            'p95': round(percentile(errors, 95), 6),
+            'max': round(float(np.max(errors)), 6) if errors else 0.0,
+        },
+        'per_number': dict(sorted(per_number.items(), key=lambda kv: int(kv[0]) if kv[0].isdigit() else 1000)),
+    }
+
+    detect_ms = [r['detect_ms'] for r in frames if 'detect_ms' in r]
+    if detect_ms:
+        decode_ms = [r['decode_ms'] for r in frames]
+        mean_ms = float(np.mean(detect_ms))
+        summary['timing_ms'] = {
+            'decode_mean': round(float(np.mean(decode_ms)), 3),
+            'detect_mean': round(mean_ms, 3),
+            'detect_p50': round(percentile(detect_ms, 50), 3),
+            'detect_p95': round(percentile(detect_ms, 95), 3),
+            'detect_max': round(float(np.max(detect_ms)), 3),
+            'fps': round(1000.0 / mean_ms, 2) if mean_ms > 0 else 0.0,
+        }
+    return summary
+
+
+def run_evaluation(pairs, worker_fn, workers, profile=None, tol=TOL, threads=None):
+    """
+    Run `worker_fn` over all pairs, in a process pool when workers > 1.
+
+    Unless `threads` is given, pooled workers split the CPU cores between them
+    (preprocess.worker_threads) so OpenCV's own threads do not oversubscribe.
+    """
+    if threads is None and workers > 1:
+        threads = worker_threads(workers)
+    init_args = (profile, tol, threads)
+    if workers <= 1:
+        init_worker(*init_args)
+        return [worker_fn(p) for p in pairs]
+    chunksize = max(1, len(pairs) // (workers * 4))
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=init_args) as pool:
+        return list(pool.imap(worker_fn, pairs, chunksize=chunksize))
+
+
+def update_report(report_path, name, summary, records):
+    """Add (or replace) the run named `name` in the report file and return all runs."""
+    report = {'runs': []}
+    if os.path.isfile(report_path):
+        with open(report_path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    runs = [r for r in report.get('runs', []) if r.get('name') != name]
+    runs.append({'name': name, 'summary': summary, 'frames': records})
+    report['runs'] = runs
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return runs
+
+
+def print_summary(name, summary):
+    print('=' * 60)
+    print(f"Run: {name}")
+    print(f"Frames: {summary['frames']} (failed: {summary['failed_frames']})")
+    print(f"TP={summary['tp']} FP={summary['fp']} FN={summary['fn']}")
+    print(f"Precision: {summary['precision']:.4f}  Recall: {summary['recall']:.4f}  F1: {summary['f1']:.4f}")
+    print(f"Classification accuracy (matched balls): {summary['classification_accuracy']:.4f}")
+    pe = summary['position_error']
+    print(f"Position error (norm): mean={pe['mean']:.6f} median={pe['median']:.6f} p95={pe['p95']:.6f} max={pe['max']:.6f}")
+    if 'timing_ms' in summary:
+        t = summary['timing_ms']
+        print(f"Detect time (ms): mean={t['detect_mean']:.2f} p50={t['detect_p50']:.2f} p95={t['detect_p95']:.2f} "
+              f"max={t['detect_max']:.2f} ({t['fps']:.1f} fps), decode mean={t['decode_mean']:.2f}")
+    print('-' * 60)
+    print(f"{'Ball':>5} {'Labeled':>8} {'Matched':>8} {'Correct':>8} {'Recall':>8} {'Acc':>8}")
+    for num, s in summary['per_number'].items():
+        print(f"{num:>5} {s['labeled']:>8} {s['matched']:>8} {s['correct']:>8} {s['recall']:>8.3f} {s['accuracy']:>8.3f}")
+
+
+def print_comparison(runs):
+    print('=' * 60)
+    print('Configurations in report:')
+    print(f"{'Name':<20} {'Prec':>7} {'Recall':>7} {'F1':>7} {'ClsAcc':>7} {'Err':>9} {'ms/frame':>9}")
+    for run in runs:
+        s = run['summary']
+        ms = s['timing_ms']['detect_mean'] if 'timing_ms' in s else float('nan')
+        print(f"{run['name']:<20} {s['precision']:>7.3f} {s['recall']:>7.3f} {s['f1']:>7.3f} "
+              f"{s['classification_accuracy']:>7.3f} {s['position_error']['mean']:>9.5f} {ms:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate detector output against hand-labeled position JSON files')
+    parser.add_argument('--labels', '-l', required=True, help='Directory containing labeled position JSON files')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--images', '-i', help='Directory of images to run the detector on (matched to labels by file name)')
+    source.add_argument('--detections', '-d', help='Directory of existing detector JSON files to score (no detection is run)')
+    parser.add_argument('--profile', '-P', help='Detector profile (JSON/YAML) or sweep.py output (default: built-in profile)')
+    parser.add_argument('--profile-name', help='Pareto front entry when --profile is a sweep.py output (e.g. pareto-1)')
+    parser.add_argument('--table-corners', '-t', help="JSON file containing table_corners (default: the profile's calibration)")
+    parser.add_argument('--tol', type=float, default=TOL, help='Match tolerance for x_norm and y_norm (default 0.025)')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+    parser.add_argument('--cv-threads', type=int,
+                        help='OpenCV threads per worker (default: CPU cores / workers, OpenCV default when serial)')
+    parser.add_argument('--name', '-n', help="Name of this detector configuration in the report (default: the profile's name)")
+    parser.add_argument('--report', '-r', help='Report JSON file; runs with other names are kept for comparison')
+
+    args = parser.parse_args()
+
+    pairs, missing = find_pairs(args.labels, args.images, args.detections)
+    if missing:
+        print(f"Warning: {len(missing)} label file(s) have no matching input: {', '.join(missing[:10])}")
+    if not pairs:
+        print('No label/input pairs found.')
+        sys.exit(2)
+
+    try:
+        profile_data = load_profile(args.profile, args.profile_name)
+    except (OSError, ValueError) as e:
+        print('Failed to load detector profile:', e)
+        sys.exit(2)
+    name = args.name or profile_data['name']
+
+    profile = None
+    if args.images:
+        calibration = load_table_transform(args.table_corners) if args.table_corners else None
+        profile = compile_profile(profile_data, calibration)
+        worker_fn = evaluate_image
+    else:
+        worker_fn = evaluate_detection_file
+
+    print(f"Evaluating {len(pairs)} frame(s) with {args.workers} worker(s)...")
+    records = run_evaluation(pairs, worker_fn, args.workers, profile, args.tol, args.cv_threads)
+    for r in records:
+        if 'error' in r:
+            print(f"Warning: frame '{r['frame']}': {r['error']}")
+
+    summary = summarize(records)
+    print_summary(name, summary)
+
+    if args.report:
+        runs = update_report(args.report, name, summary, records)
+        print(f"Report saved to {args.report}")
+        if len(runs) > 1:
+            print_comparison(runs)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,4 @@
 import cv2
-from matplotlib.pyplot import gray
 import numpy as np
 import os
 import glob
@@ -7,156 +6,86 @@ import json
 import sys
 import argparse
 
-TABLE_CORNERS_FILE = "table_corners.json"
+from calibration import get_pockets
+from output_writer import OutputWriter
+from preprocess import Preprocessor, configure_threads
+from profiles import DEFAULT_PROFILE, color_row, compile_profile, load_profile
+from rectify import RectifiedStream
 
-def get_ball_number(b, g, r, brightness, detect_cue_ball=False):
+# Bảng màu mặc định (bi 1-15), dùng khi get_ball_number được gọi không kèm bảng màu
+DEFAULT_COLOR_TABLE = compile_profile(load_profile(), calibration=(None, None))['color_table']
+CUE_BALL_ROW = color_row(16, DEFAULT_PROFILE['classifier']['cue_ball'])
+
+_default_profile = None
+
+def get_default_profile():
+    """
+    Profile mặc định đã biên dịch (đọc TABLE_CORNERS_FILE một lần cho cả tiến trình)
+    """
+    global _default_profile
+    if _default_profile is None:
+        _default_profile = compile_profile(load_profile())
+    return _default_profile
+
+def get_ball_number(b, g, r, brightness, detect_cue_ball=False, color_table=None):
     """
     Xác định số thứ tự bi dựa trên màu BGR và độ sáng trung bình
     
     Args:
         b, g, r: Giá trị màu BGR (0-255)
         brightness: Độ sáng trung bình (0-255)
-        detect_cue_ball: Có phát hiện bi 16 (cue ball) hay không
+        detect_cue_ball: Có phát hiện bi 16 (cue ball) hay không (chỉ dùng với bảng màu mặc định)
+        color_table: Bảng màu đã biên dịch từ profile (compile_profile()['color_table'])
     
     Returns:
         int: Số thứ tự bi (1-15 hoặc 16 nếu detect_cue_ball=True), hoặc 0 nếu không khớp
     """
+    if color_table is None:
+        color_table = DEFAULT_COLOR_TABLE + [CUE_BALL_ROW] if detect_cue_ball else DEFAULT_COLOR_TABLE
 
-    # Danh sách các pattern bi (không bao gồm cue ball)
-    base_patterns = [
-        # Bi 1: Màu vàng sáng
-        (1, lambda b,g,r,br: 20<=b<=90 and 150<=g<=230 and 150<=r<=230 and 140<=br<=190),
-        
-        # Bi 2: Màu xanh dương
-        (2, lambda b,g,r,br: 140<=b<=190 and 80<=g<=120 and 10<=r<=45 and 70<=br<=110),
-        
-        # Bi 3: Màu đỏ
-        (3, lambda b,g,r,br: 30<=b<=100 and 25<=g<=90 and 110<=r<=255 and 70<=br<=140),
-        
-        # Bi 4: Màu hồng
-        (4, lambda b,g,r,br: 155<=b<=170 and 90<=g<=100 and 200<=r<=240 and 130<=br<=150),
-        
-        # Bi 5: Màu cam
-        (5, lambda b,g,r,br: 30<=b<=95 and 80<=g<=145 and 160<=r<=225 and 100<=br<=160),
-        
-        # Bi 6: Màu xanh lá đậm
-        (6, lambda b,g,r,br: 80<=b<=120 and 100<=g<=150 and 15<=r<=45 and 75<=br<=110),
-        
-        # Bi 7: Màu xanh lá nhạt
-        (7, lambda b,g,r,br: 55<=b<=125 and 70<=g<=140 and 65<=r<=135 and 75<=br<=125),
-        
-        # Bi 8: Màu xanh đậm
-        (8, lambda b,g,r,br: 75<=b<=110 and 55<=g<=90 and 25<=r<=55 and 50<=br<=80),
-        
-        # Bi 9: Màu vàng nhạt
-        (9, lambda b,g,r,br: 80<=b<=135 and 165<=g<=205 and 160<=r<=230 and 165<=br<=200),
-        
-        # Bi 10: Màu xanh dương nhạt
-        (10, lambda b, g, r, br: 170 <= b <= 210 and 120 <= g <= 160 and 65 <= r <= 105 and 115 <= br <= 145),
-        
-        # Bi 11: Màu đỏ viền trắng 
-        (11, lambda b,g,r,br: 95<=b<=115 and 95<=g<=105 and 210<=r<=230 and 125<=br<=150),
-
-        # Bi 12: Màu hồng viền trắng
-        (12, lambda b, g, r, br: 169 <= b <= 209 and 122 <= g <= 162 and 201 <= r <= 241 and 151 <= br <= 191),
-
-        # Bi 13: Màu cam viền trắng
-        (13, lambda b, g, r, br: 87 <= b <= 127 and 135 <= g <= 175 and 204 <= r <= 244 and 149 <= br <= 189),
-        
-        # Bi 14: Màu xanh lá viền trắng
-        (14, lambda b, g, r, br: 117 <= b <= 157 and 136 <= g <= 176 and 65 <= r <= 105 and 110 <= br <= 150),
-
-        # Bi 15: Màu tím viền trắng
-        (15, lambda b, g, r, br: 91 <= b <= 131 and 117 <= g <= 157 and 149 <= r <= 189 and 124 <= br <= 164),
-    ]
-    
-    # Tạo danh sách patterns cuối cùng
-    ball_patterns = base_patterns.copy()
-    
-    # Chỉ thêm cue ball nếu được yêu cầu
-    if detect_cue_ball:
-        ball_patterns.append((16, lambda b,g,r,br: 160<=b<=255 and 160<=g<=255 and 160<=r<=255 and 160<=br<=255))
-
-    for ball_num, pattern_func in ball_patterns:
-        if pattern_func(b, g, r, brightness):
+    # Mỗi dòng: (số bi, (b, g, r, sáng) nhỏ nhất, (b, g, r, sáng) lớn nhất); dòng đầu tiên khớp được chọn
+    for ball_num, lo, hi in color_table:
+        if (lo[0] <= b <= hi[0] and lo[1] <= g <= hi[1]
+                and lo[2] <= r <= hi[2] and lo[3] <= brightness <= hi[3]):
             return ball_num
     
     return 0
 
-def detect_circles(image_path, annotated_output_path, json_output_path, detect_cue_ball=False):
+def prepare_planes(img, profile=None):
     """
-    Phát hiện các vật thể hình tròn (bi và lỗ) trên bàn bi-a
-    
-    Args:
-        image_path: Đường dẫn đến ảnh đầu vào
-        annotated_output_path: Đường dẫn lưu ảnh đã chú thích
-        json_output_path: Đường dẫn lưu file JSON với tọa độ các bi
-        detect_cue_ball: Có phát hiện bi 16 (cue ball) hay không
-    """
-    # Đọc ảnh
-    img = cv2.imread(image_path)
-    if img is None:
-        print(f"Không thể đọc ảnh từ {image_path}")
-        return
-    
-    # Tạo bản sao để vẽ
-    output = img.copy()
+    Tính các mặt phẳng dùng cho phát hiện: ảnh xám và ảnh đưa vào HoughCircles
 
-    # Load table corners and compute perspective transform to table coordinate system
-    table_corners = None
-    transform_M = None
-    table_size = None
-    try:
-        with open(TABLE_CORNERS_FILE, 'r', encoding='utf-8') as f:
-            tc = json.load(f)
-            # Expecting structure { "table_corners": [[x1,y1],[x2,y2],[x3,y3],[x4,y4]] }
-            if 'table_corners' in tc and len(tc['table_corners']) == 4:
-                table_corners = np.array(tc['table_corners'], dtype=np.float32)
-                # We'll map these to a rectangular table coordinate system with origin at top-left
-                # Compute width and height from corners (take max of opposing edges)
-                widthA = np.linalg.norm(table_corners[1] - table_corners[0])
-                widthB = np.linalg.norm(table_corners[2] - table_corners[3])
-                maxWidth = int(max(widthA, widthB))
+    Mỗi lần gọi cấp phát mảng mới, nên kết quả có thể giữ lại (ví dụ cache trong sweep.py).
+    Khi xử lý nhiều frame liên tiếp, dùng preprocess.Preprocessor để tái sử dụng bộ đệm.
 
-                heightA = np.linalg.norm(table_corners[3] - table_corners[0])
-                heightB = np.linalg.norm(table_corners[2] - table_corners[1])
-                maxHeight = int(max(heightA, heightB))
+    Returns:
+        tuple: (gray, combined)
+    """
+    p = get_default_profile() if profile is None else profile
+    return Preprocessor(p, use_umat=False).planes(img)
 
-                table_size = (maxWidth, maxHeight)
+def find_balls(img, profile=None, planes=None):
+    """
+    Phát hiện và phân loại các viên bi trong ảnh (không ghi file, không in log)
 
-                dst = np.array([[0, 0], [maxWidth - 1, 0], [maxWidth - 1, maxHeight - 1], [0, maxHeight - 1]], dtype=np.float32)
-                transform_M = cv2.getPerspectiveTransform(table_corners, dst)
-            else:
-                print(f"Warning: '{TABLE_CORNERS_FILE}' not in expected format. Falling back to image coordinates.")
-    except FileNotFoundError:
-        print(f"Warning: '{TABLE_CORNERS_FILE}' not found. Falling back to image coordinates.")
-    except Exception as e:
-        print(f"Warning: failed to load '{TABLE_CORNERS_FILE}': {e}. Falling back to image coordinates.")
-    
-    # Tách các kênh màu để bảo toàn thông tin màu sắc
-    b, g, r = cv2.split(img)
-    
-    # Chuyển sang ảnh xám nhưng với trọng số tối ưu để giữ lại chi tiết
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    # Tạo ảnh tổng hợp từ các kênh màu để phát hiện hình tròn tốt hơn
-    # Sử dụng kênh có contrast cao nhất
-    combined = np.maximum(np.maximum(r, g), b)
+    Args:
+        img: Ảnh BGR đã đọc
+        profile: Profile đã biên dịch (mặc định: get_default_profile())
+        planes: (gray, combined) đã tính sẵn từ prepare_planes, dùng lại giữa các lần gọi
+
+    Returns:
+        list: Các bi phát hiện được
+    """
+    p = get_default_profile() if profile is None else profile
+    gray, combined = planes if planes is not None else prepare_planes(img, p)
+    ball_min_radius, ball_max_radius = p['ball_radius']
 
     # Phát hiện tất cả các hình tròn từ ảnh tổng hợp
-    circles = cv2.HoughCircles(
-        combined,
-        cv2.HOUGH_GRADIENT,
-        dp=1.0,
-        minDist=15,  # 15
-        param1=200,  # 200
-        param2=15,   # 15
-        minRadius=8, # 8
-        maxRadius=13 # 13
-    )
+    circles = cv2.HoughCircles(combined, cv2.HOUGH_GRADIENT, **p['hough'])
+    if isinstance(circles, cv2.UMat):
+        circles = circles.get()
     
     detected_balls = []
-    hole_count = 0
     
     # Xử lý tất cả các hình tròn được phát hiện
     if circles is not None:
@@ -182,14 +111,14 @@ def detect_circles(image_path, annotated_output_path, json_output_path, detect_c
                 b_avg, g_avg, r_avg = avg_bgr
                 
                 # Phân loại dựa trên kích thước và màu sắc
-                if 8 <= radius <= 12 and avg_color > 50:  # Bi lớn và có màu
+                if ball_min_radius <= radius <= ball_max_radius and avg_color > p['min_avg_color']:  # Bi lớn và có màu
                     # Kiểm tra nếu bi màu trắng (giá trị BGR cao và cân bằng)
                     # is_white = (b_avg > 180 and g_avg > 180 and r_avg > 180 and 
                             #    abs(b_avg - g_avg) < 30 and abs(g_avg - r_avg) < 30 and abs(b_avg - r_avg) < 30)
                     
                     # if not is_white:  # Chỉ xử lý bi không phải màu trắng
                         # Sử dụng hàm get_ball_number để xác định số bi
-                        ball_number = get_ball_number(int(b_avg), int(g_avg), int(r_avg), int(avg_intensity), detect_cue_ball)
+                        ball_number = get_ball_number(int(b_avg), int(g_avg), int(r_avg), int(avg_intensity), color_table=p['color_table'])
                         
                         # Lưu thông tin bi với số thứ tự
                         if (ball_number > 0):
@@ -201,8 +130,137 @@ def detect_circles(image_path, annotated_output_path, json_output_path, detect_c
                                 'number': ball_number
                             }
                             detected_balls.append(ball_info)
-                elif radius <= 6 and avg_intensity < 50:  # Lỗ nhỏ và tối màu
-                    hole_count += 1
+
+    return detected_balls
+
+def find_pockets(img, profile=None, gray=None):
+    """
+    Vị trí 6 lỗ bàn, chỉ tìm một lần cho mỗi calibration (xem calibration.get_pockets)
+
+    Args:
+        img: Ảnh BGR đã đọc
+        profile: Profile đã biên dịch (mặc định: get_default_profile())
+        gray: Ảnh xám đã tính sẵn (nếu có)
+
+    Returns:
+        list: Danh sách lỗ, hoặc None nếu tắt trong profile hoặc không có góc bàn
+    """
+    p = get_default_profile() if profile is None else profile
+    if not p['pockets']['enabled'] or p['transform_M'] is None:
+        return None
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return get_pockets(gray, p['table_corners_file'], p['transform_M'], p['table_size'], p['pockets'])
+
+def build_positions(detected_balls, transform_M, table_size, img_shape, pockets=None):
+    """
+    Tạo cấu trúc JSON tọa độ bi (cùng định dạng với positions-selector.py)
+
+    Args:
+        detected_balls: Danh sách bi từ find_balls
+        transform_M: Ma trận perspective (hoặc None)
+        table_size: (width, height) của bàn (hoặc None)
+        img_shape: Kích thước ảnh, dùng để chuẩn hóa khi không có table_size
+        pockets: Danh sách lỗ từ find_pockets (nếu có)
+
+    Returns:
+        dict: {"balls": [...], "table_size": {...}, "pockets": [...]}
+    """
+    balls_data = []
+    for ball in detected_balls:
+        cx, cy = ball['center']
+        if transform_M is not None:
+            src_pt = np.array([[[cx, cy]]], dtype=np.float32)
+            dst_pt = cv2.perspectiveTransform(src_pt, transform_M)[0][0]
+            tx, ty = int(dst_pt[0]), int(dst_pt[1])
+        else:
+            tx, ty = int(cx), int(cy)
+
+        # Determine normalization base (table size if available, otherwise image size)
+        if table_size is not None:
+            norm_w, norm_h = table_size[0], table_size[1]
+        else:
+            norm_w, norm_h = img_shape[1], img_shape[0]
+
+        # Avoid division by zero
+        x_norm = float(tx) / float(norm_w) if norm_w > 0 else 0.0
+        y_norm = float(ty) / float(norm_h) if norm_h > 0 else 0.0
+
+        ball_data = {
+            "number": int(ball['number']),
+            "x": tx,
+            "y": ty,
+            "x_norm": round(x_norm, 6),
+            "y_norm": round(y_norm, 6)
+        }
+        balls_data.append(ball_data)
+    
+    # Tạo cấu trúc JSON cuối cùng
+    json_data = {
+        "balls": balls_data
+    }
+    # If we computed table size, include it so consumers know coordinate space
+    if table_size is not None:
+        json_data['table_size'] = {"width": int(table_size[0]), "height": int(table_size[1])}
+    if pockets is not None:
+        json_data['pockets'] = [{k: pk[k] for k in ('name', 'x', 'y', 'x_norm', 'y_norm', 'detected')} for pk in pockets]
+    return json_data
+
+def detect_positions(img, profile=None, preprocessor=None):
+    """
+    Phát hiện bi (và lỗ) và trả về dữ liệu JSON tọa độ, không vẽ, không ghi file, không in log
+
+    Args:
+        img: Ảnh BGR đã đọc
+        profile: Profile đã biên dịch (mặc định: get_default_profile())
+        preprocessor: preprocess.Preprocessor dùng lại bộ đệm giữa các ảnh (nếu có)
+
+    Returns:
+        dict: Như build_positions
+    """
+    p = get_default_profile() if profile is None else profile
+    planes = preprocessor.planes(img) if preprocessor is not None else prepare_planes(img, p)
+    detected_balls = find_balls(img, p, planes)
+    pockets = find_pockets(img, p, planes[0])
+    return build_positions(detected_balls, p['transform_M'], p['table_size'], img.shape, pockets)
+
+def detect_circles(image_path, annotated_output_path, json_output_path, profile=None, preprocessor=None, writer=None,
+                   rectified=None):
+    """
+    Phát hiện các vật thể hình tròn (bi và lỗ) trên bàn bi-a
+    
+    Args:
+        image_path: Đường dẫn đến ảnh đầu vào
+        annotated_output_path: Đường dẫn lưu ảnh đã chú thích
+        json_output_path: Đường dẫn lưu file JSON với tọa độ các bi
+        profile: Profile đã biên dịch (mặc định: get_default_profile())
+        preprocessor: preprocess.Preprocessor dùng lại bộ đệm giữa các ảnh (nếu có)
+        writer: output_writer.OutputWriter để ghi file ở luồng nền (nếu có)
+        rectified: rectify.RectifiedStream để ghi ảnh bàn nhìn từ trên xuống của frame (nếu có)
+    """
+    # Đọc ảnh
+    img = cv2.imread(image_path)
+    if img is None:
+        print(f"Không thể đọc ảnh từ {image_path}")
+        return
+    
+    # Ảnh bàn nắn thẳng (bảng remap đã tính sẵn cho calibration), ghi cùng kết quả detect
+    if rectified is not None:
+        rectified.write(os.path.basename(image_path), img)
+    
+    # Tạo bản sao để vẽ
+    output = img.copy()
+
+    # Perspective transform sang hệ tọa độ bàn đã được tính sẵn trong profile
+    profile = get_default_profile() if profile is None else profile
+    transform_M, table_size = profile['transform_M'], profile['table_size']
+    
+    if preprocessor is not None:
+        gray, combined = preprocessor.planes(img)
+    else:
+        gray, combined = prepare_planes(img, profile)
+    detected_balls = find_balls(img, profile, (gray, combined))
+    pockets = find_pockets(img, profile, gray)
     
     # In thông tin và vẽ tất cả các hình tròn được phát hiện
     for i, ball in enumerate(detected_balls, 1):
@@ -268,63 +326,43 @@ def detect_circles(image_path, annotated_output_path, json_output_path, detect_c
     # Đếm số hình tròn được phát hiện
     ball_count = len(detected_balls)
     
+    # Vẽ vị trí các lỗ (viền trắng nếu tìm thấy, xám nếu chỉ là vị trí danh nghĩa)
+    if pockets is not None:
+        for pk in pockets:
+            color = (255, 255, 255) if pk['detected'] else (128, 128, 128)
+            cv2.circle(output, (pk['image_x'], pk['image_y']), max(pk['radius'], 6), color, 2)
+    
     # Thêm thông tin tổng quan
-    info_text = f'Circles: {ball_count} | Holes: {hole_count} | Total: {ball_count + hole_count}'
+    pocket_count = sum(1 for pk in pockets if pk['detected']) if pockets is not None else 0
+    info_text = f'Circles: {ball_count} | Pockets: {pocket_count}/6'
     cv2.putText(output, info_text, (10, 30),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
     
-    # Lưu ảnh kết quả đã chú thích
-    cv2.imwrite(annotated_output_path, output)
-    
     # Tạo dữ liệu JSON với tọa độ các bi
-    balls_data = []
-    for ball in detected_balls:
-        # Map to table coordinates if transform available
-        cx, cy = ball['center']
-        if transform_M is not None:
-            src_pt = np.array([[[cx, cy]]], dtype=np.float32)
-            dst_pt = cv2.perspectiveTransform(src_pt, transform_M)[0][0]
-            tx, ty = int(dst_pt[0]), int(dst_pt[1])
-        else:
-            tx, ty = int(cx), int(cy)
-
-        # Determine normalization base (table size if available, otherwise image size)
-        if table_size is not None:
-            norm_w, norm_h = table_size[0], table_size[1]
-        else:
-            norm_w, norm_h = img.shape[1], img.shape[0]
-
-        # Avoid division by zero
-        x_norm = float(tx) / float(norm_w) if norm_w > 0 else 0.0
-        y_norm = float(ty) / float(norm_h) if norm_h > 0 else 0.0
-
-        ball_data = {
-            "number": int(ball['number']),
-            "x": tx,
-            "y": ty,
-            "x_norm": round(x_norm, 6),
-            "y_norm": round(y_norm, 6)
-        }
-        balls_data.append(ball_data)
-    
-    # Tạo cấu trúc JSON cuối cùng
-    json_data = {
-        "balls": balls_data
-    }
-    # If we computed table size, include it so consumers know coordinate space
-    if table_size is not None:
-        json_data['table_size'] = {"width": int(table_size[0]), "height": int(table_size[1])}
+    json_data = build_positions(detected_balls, transform_M, table_size, img.shape, pockets)
     
-    # Lưu file JSON
-    with open(json_output_path, 'w', encoding='utf-8') as f:
-        json.dump(json_data, f, ensure_ascii=False, indent=2)
+    # Lưu ảnh kết quả đã chú thích và file JSON (ở luồng nền nếu có writer)
+    if writer is not None:
+        if profile['output']['write_annotated']:
+            writer.write_image(annotated_output_path, output)
+        writer.write_json(json_output_path, json_data)
+    else:
+        if profile['output']['write_annotated']:
+            cv2.imwrite(annotated_output_path, output)
+        with open(json_output_path, 'w', encoding='utf-8') as f:
+            json.dump(json_data, f, ensure_ascii=False, indent=profile['output']['json_indent'])
     
     # In tổng kết
     print("=" * 50)
     print(f"KET QUA PHAT HIEN:")
     print(f"Tổng số bi phát hiện: {ball_count}")
+    if pockets is not None:
+        print(f"Số lỗ tìm thấy: {pocket_count}/6")
     print(f"Ảnh đã chú thích được lưu tại: {annotated_output_path}")
-    print(f"File JSON tọa độ được lưu tại: {json_output_path}")
+    if writer is not None and writer.jsonl_path:
+        print(f"Tọa độ được gộp vào: {writer.jsonl_path}")
+    else:
+        print(f"File JSON tọa độ được lưu tại: {json_output_path}")
     print("=" * 50)
     
     return json_data
@@ -336,12 +374,47 @@ if __name__ == "__main__":
                        help='Đường dẫn đến file ảnh hoặc thư mục chứa ảnh (mặc định: input)')
     parser.add_argument('--cue-ball', action='store_true', 
                        help='Phát hiện bi 16 (cue ball - bi trắng)')
+    parser.add_argument('--profile',
+                       help='File profile detector (JSON/YAML) hoặc file kết quả của sweep.py')
+    parser.add_argument('--profile-name',
+                       help='Tên bộ tham số khi --profile là file của sweep.py (ví dụ pareto-1)')
+    parser.add_argument('--cv-threads', type=int,
+                       help='Số luồng OpenCV (mặc định: theo OpenCV)')
+    parser.add_argument('--writer-threads', type=int,
+                       help='Số luồng ghi file ở nền, 0 = ghi đồng bộ (mặc định: theo profile)')
+    parser.add_argument('--jsonl',
+                       help='Gộp tọa độ mọi ảnh vào một file JSON Lines thay vì mỗi ảnh một file')
+    parser.add_argument('--rectify', nargs='?', const='',
+                       help='Ghi thêm ảnh bàn nhìn từ trên xuống vào thư mục hoặc file video này (mặc định: theo profile)')
+    parser.add_argument('--rectify-scale', type=float,
+                       help='Tỉ lệ kích thước ảnh bàn nắn thẳng (ví dụ 0.5)')
     
     args = parser.parse_args()
     
     # Xác định input source
     input_path = args.input_path
-    detect_cue_ball = args.cue_ball
+    try:
+        profile_data = load_profile(args.profile, args.profile_name)
+    except (OSError, ValueError) as e:
+        print(f"Không thể đọc profile detector: {e}")
+        exit(1)
+    if args.cue_ball:
+        profile_data['classifier']['detect_cue_ball'] = True
+    if args.rectify is not None:
+        profile_data['rectify']['enabled'] = True
+        if args.rectify:
+            profile_data['rectify']['output'] = args.rectify
+    if args.rectify_scale is not None:
+        if not 0 < args.rectify_scale <= 4:
+            print("--rectify-scale phải nằm trong (0, 4]")
+            exit(1)
+        profile_data['rectify']['scale'] = args.rectify_scale
+    detect_cue_ball = profile_data['classifier']['detect_cue_ball']
+    # Biên dịch profile một lần (bao gồm đọc file góc bàn) cho tất cả ảnh
+    profile = compile_profile(profile_data)
+    print(f"Profile: {profile['name']}")
+    configure_threads(args.cv_threads, profile['opencl'])
+    preprocessor = Preprocessor(profile)
     
     if os.path.isfile(input_path):
         # Input là một file đơn lẻ
@@ -355,6 +428,9 @@ if __name__ == "__main__":
         for extension in image_extensions:
             image_files.extend(glob.glob(os.path.join(input_folder, extension)))
             image_files.extend(glob.glob(os.path.join(input_folder, extension.upper())))
+        # Bỏ trùng (*.png và *.PNG khớp cùng file trên hệ thống file không phân biệt hoa thường)
+        # và giữ thứ tự tên file ổn định, để video nắn thẳng đúng thứ tự frame
+        image_files = sorted(set(image_files))
     else:
         print(f"Đường dẫn '{input_path}' không tồn tại!")
         print("Sử dụng: python main.py [đường_dẫn_file_hoặc_folder] [--cue-ball]")
@@ -365,40 +441,70 @@ if __name__ == "__main__":
         exit(1)
     
     # Tạo folder output nếu chưa tồn tại
-    output_annotated_folder = "output/annotated"
-    output_position_folder = "output/position"
+    output_annotated_folder = profile['output']['annotated_dir']
+    output_position_folder = profile['output']['position_dir']
     
     if not os.path.exists(output_annotated_folder):
         os.makedirs(output_annotated_folder)
     
-    if not os.path.exists(output_position_folder):
+    jsonl_path = args.jsonl or profile['output']['jsonl']
+    if not jsonl_path and not os.path.exists(output_position_folder):
         os.makedirs(output_position_folder)
     
+    writer_threads = args.writer_threads if args.writer_threads is not None else profile['output']['writer_threads']
+    writer = OutputWriter(threads=writer_threads, max_pending=profile['output']['max_pending'],
+                          jsonl_path=jsonl_path, json_indent=profile['output']['json_indent'])
+    
+    rectified = None
+    if profile['rectify']['enabled']:
+        if profile['transform_M'] is None:
+            print("Bỏ qua ảnh bàn nắn thẳng: cần file góc bàn")
+        else:
+            rectified = RectifiedStream(profile['transform_M'], profile['table_size'], profile['rectify'], writer)
+    
     print(f"Tìm thấy {len(image_files)} file ảnh")
     print("=" * 60)
     
-    # Xử lý từng ảnh
-    for i, image_path in enumerate(image_files, 1):
-        # Lấy tên file không có đường dẫn
-        filename = os.path.basename(image_path)
-        name, ext = os.path.splitext(filename)
-        
-        # Tạo đường dẫn output
-        annotated_output_path = os.path.join(output_annotated_folder, filename)
-        json_output_path = os.path.join(output_position_folder, f"{name}.json")
-        
-        print(f"Đang xử lý ảnh {i}/{len(image_files)}: {filename}")
-        print("-" * 40)
-        
-        # Gọi hàm detect circles
-        result = detect_circles(image_path, annotated_output_path, json_output_path, detect_cue_ball)
-        
-        print(f"Số bi được phát hiện: {len(result['balls'])}")
-        print("=" * 60)
+    # Xử lý từng ảnh; việc ghi file chạy song song ở luồng nền
+    try:
+        for i, image_path in enumerate(image_files, 1):
+            # Lấy tên file không có đường dẫn
+            filename = os.path.basename(image_path)
+            name, ext = os.path.splitext(filename)
+            
+            # Tạo đường dẫn output
+            annotated_output_path = os.path.join(output_annotated_folder, filename)
+            json_output_path = os.path.join(output_position_folder, f"{name}.json")
+            
+            print(f"Đang xử lý ảnh {i}/{len(image_files)}: {filename}")
+            print("-" * 40)
+            
+            # Gọi hàm detect circles
+            result = detect_circles(image_path, annotated_output_path, json_output_path, profile, preprocessor, writer,
+                                    rectified)
+            
+            if result is not None:
+                print(f"Số bi được phát hiện: {len(result['balls'])}")
+            print("=" * 60)
+        # Chờ ghi xong toàn bộ file trước khi báo hoàn thành
+        if rectified is not None:
+            rectified.close()
+        writer.close()
+    except (OSError, cv2.error) as e:
+        if rectified is not None:
+            rectified.close(raise_errors=False)
+        writer.close(raise_errors=False)
+        print(f"Lỗi khi ghi kết quả: {e}")
+        exit(1)
     
     print("Hoàn thành xử lý tất cả ảnh!")
     print(f"Ảnh đã chú thích được lưu trong: {output_annotated_folder}")
-    print(f"File JSON tọa độ được lưu trong: {output_position_folder}")
+    if jsonl_path:
+        print(f"Tọa độ được gộp vào: {jsonl_path}")
+    else:
+        print(f"File JSON tọa độ được lưu trong: {output_position_folder}")
+    if rectified is not None:
+        print(f"Ảnh bàn nắn thẳng ({rectified.frames} frame) được lưu tại: {rectified.output}")
     if detect_cue_ball:
         print("✅ Đã bao gồm phát hiện bi 16 (cue ball)")
     else:
@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+class OutputWriter:
+    """
+    Ghi ảnh chú thích và file tọa độ ở luồng nền trong khi detector xử lý ảnh tiếp theo
+
+    - Số việc đang chờ bị giới hạn bởi `max_pending`: khi đầy, lần ghi tiếp theo sẽ chờ
+      (tránh giữ quá nhiều ảnh trong bộ nhớ khi ổ đĩa / mạng chậm hơn detector)
+    - Lỗi ghi ở luồng nền được ném lại ở lần gọi write_* kế tiếp, hoặc ở flush()/close()
+    - Nếu có `jsonl_path`, mọi file tọa độ được gộp thành một file JSON Lines
+      (mỗi dòng một ảnh, có thêm khóa "image") thay vì nhiều file nhỏ; file được ghi mới,
+      trừ khi append=True (ghi tiếp, dùng khi chạy tiếp một lần chạy dở)
+    - threads=0: ghi đồng bộ ngay trong luồng gọi
+
+    Ảnh và dict truyền vào không được sửa sau khi gọi write_*.
+
+    Usage:
+        with OutputWriter(threads=2, jsonl_path='output/positions.jsonl') as writer:
+            writer.write_image('output/annotated/1.jpg', img)
+            writer.write_json('output/position/1.json', data)
+    """
+
+    def __init__(self, threads=2, max_pending=16, jsonl_path=None, json_indent=2, append=False):
+        self.threads = threads
+        self.max_pending = max(1, max_pending)
+        self.json_indent = json_indent
+        self.jsonl_path = jsonl_path
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='output-writer') if threads > 0 else None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._error = None
+        self._closed = False
+        self._jsonl = None
+        self._jsonl_lock = threading.Lock()
+        if jsonl_path:
+            folder = os.path.dirname(jsonl_path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._jsonl = open(jsonl_path, 'a' if append else 'w', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Không che lỗi gốc của khối with bằng lỗi ghi
+        self.close(raise_errors=exc_type is None)
+        return False
+
+    def write_image(self, path, img, done=None):
+        """
+        Mã hóa và ghi ảnh (cv2.imwrite) ở luồng nền
+
+        `done()` (nếu có) được gọi khi việc ghi ảnh này kết thúc, kể cả khi lỗi hoặc không được
+        gửi đi; dùng để trả bộ đệm ảnh về pool chỉ khi không còn ai đọc nó.
+        """
+        self._submit(self._write_image, path, img, done=done)
+
+    def write_frame(self, video, img, done=None):
+        """Ghi một frame vào cv2.VideoWriter ở luồng nền (dùng threads=1 để giữ thứ tự frame); `done` như write_image."""
+        self._submit(video.write, img, done=done)
+
+    def write_json(self, path, data, image=None):
+        """
+        Ghi file JSON tọa độ, hoặc thêm một dòng vào file JSON Lines nếu đang gộp
+
+        `image` là khóa "image" của dòng JSON Lines (mặc định: tên file không đuôi của `path`).
+        """
+        if self._jsonl is not None:
+            record = {'image': image if image is not None else os.path.splitext(os.path.basename(path))[0]}
+            record.update(data)
+            self._submit(self._append_jsonl, record)
+        else:
+            self._submit(self._write_json, path, data)
+
+    def flush(self, sync=False):
+        """
+        Chờ mọi việc đang chờ hoàn tất; ném lỗi đầu tiên nếu có
+
+        sync=True: fsync file JSON Lines để dữ liệu đã ghi chắc chắn nằm trên đĩa (dùng trước khi checkpoint).
+        """
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.exception()
+        if self._jsonl is not None:
+            with self._jsonl_lock:
+                self._jsonl.flush()
+                if sync:
+                    os.fsync(self._jsonl.fileno())
+        self._raise_error()
+
+    def close(self, raise_errors=True):
+        """Flush, dừng luồng nền và đóng file JSON Lines."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+        finally:
+            if self._jsonl is not None:
+                self._jsonl.close()
+        if raise_errors:
+            self._raise_error()
+
+    def _submit(self, fn, *args, done=None):
+        try:
+            if self._closed:
+                raise RuntimeError('OutputWriter is closed')
+            self._raise_error()
+            if self._executor is None:
+                fn(*args)
+            else:
+                self._slots.acquire()
+                try:
+                    future = self._executor.submit(self._run, fn, *args)
+                except BaseException:
+                    self._slots.release()
+                    raise
+        except BaseException:
+            # Việc không được gửi đi (hoặc ghi đồng bộ thất bại): vẫn báo kết thúc
+            if done is not None:
+                done()
+            raise
+        if self._executor is None:
+            if done is not None:
+                done()
+            return
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(lambda f: self._done(f, done))
+
+    def _done(self, future, done=None):
+        try:
+            if done is not None:
+                done()
+        finally:
+            with self._lock:
+                self._pending.discard(future)
+            self._slots.release()
+
+    def _run(self, fn, *args):
+        # Lỗi được ghi nhận ngay trong việc ghi, trước khi future hoàn tất: flush() chờ future
+        # xong là chắc chắn thấy lỗi (done-callback có thể chạy sau khi luồng chờ đã được đánh thức)
+        try:
+            fn(*args)
+        except BaseException as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            raise
+
+    def _raise_error(self):
+        with self._lock:
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _write_image(self, path, img):
+        if not cv2.imwrite(path, img):
+            raise OSError(f"Failed to write image '{path}'")
+
+    def _write_json(self, path, data):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=self.json_indent)
+
+    def _append_jsonl(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        with self._jsonl_lock:
+            self._jsonl.write(line + '\n')
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Pattern library maintenance for compare_positions.py
+- Canonicalize every pattern under the flip group (none / h / v / hv): each pattern is stored
+  flipped so that its ball centroid lies in the top-left quadrant, so a query only re-tests
+  the flips whose axis is ambiguous (shot centroid within tol of the table middle)
+- Merge near-identical patterns: a pattern within tol of an earlier one (same ball count,
+  balls compared by number as with --order) becomes a duplicate of it; a query reports one
+  file per group (duplicates are only tested when the kept pattern does not match)
+- Group unique patterns into clusters around representatives; a query compares the shot with
+  the representatives first and only descends into clusters that can contain a match
+  (pruning uses the triangle inequality of the per-ball max distance, so no match is lost)
+
+The library is an index file next to the pattern folder; pattern files are not modified.
+
+Usage:
+  python3 pattern_library.py build --patterns-dir patterns/position --index patterns/library.json
+  python3 pattern_library.py stats --index patterns/library.json
+  python3 compare_positions.py shots/shot1-output.json --index patterns/library.json
+
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+
+from compare_positions import TOL, apply_flip_to_norms, compare, load_positions, sort_balls
+
+INDEX_VERSION = 2
+DEFAULT_INDEX = 'patterns/library.json'
+# Cluster radius in multiples of the matching tolerance
+CLUSTER_FACTOR = 4.0
+
+FLIP_BITS = {'none': (False, False), 'h': (True, False), 'v': (False, True), 'hv': (True, True)}
+
+
+def compose_flips(*modes):
+    """Flip mode equivalent to applying all `modes` in sequence (flips commute and are involutions)."""
+    fx = fy = False
+    for mode in modes:
+        bx, by = FLIP_BITS[mode]
+        fx ^= bx
+        fy ^= by
+    return {bits: name for name, bits in FLIP_BITS.items()}[(fx, fy)]
+
+
+def centroid(balls):
+    if not balls:
+        return 0.5, 0.5
+    return (sum(b['x_norm'] for b in balls) / len(balls),
+            sum(b['y_norm'] for b in balls) / len(balls))
+
+
+def canonical_flip(balls):
+    """Flip that moves the ball centroid to x <= 0.5 and y <= 0.5."""
+    cx, cy = centroid(balls)
+    return compose_flips('h' if cx > 0.5 else 'none', 'v' if cy > 0.5 else 'none')
+
+
+def candidate_flips(balls, tol):
+    """
+    Flips of a canonical shot that still have to be tested against canonical patterns
+
+    If a shot matches a pattern within tol, their centroids differ by at most tol per axis,
+    so both canonicalize the same way on every axis whose centroid is farther than tol from 0.5.
+    """
+    cx, cy = centroid(balls)
+    xs = ['none', 'h'] if abs(cx - 0.5) <= tol else ['none']
+    ys = ['none', 'v'] if abs(cy - 0.5) <= tol else ['none']
+    return [compose_flips(x, y) for x in xs for y in ys]
+
+
+def canonicalize(balls):
+    """Return (flip, canonical balls sorted by number)."""
+    flip = canonical_flip(balls)
+    return flip, sort_balls(apply_flip_to_norms(balls, flip))
+
+
+def as_array(balls):
+    """(n, 2) array of normalized coordinates in the given ball order."""
+    return np.array([[b['x_norm'], b['y_norm']] for b in balls], dtype=np.float64).reshape(-1, 2)
+
+
+def distance(a, b):
+    """Largest per-ball, per-axis coordinate difference (balls compared in order)."""
+    if len(a) == 0:
+        return 0.0
+    return float(np.abs(a - b).max())
+
+
+def flip_array(arr, mode):
+    fx, fy = FLIP_BITS[mode]
+    out = arr.copy()
+    if fx:
+        out[:, 0] = 1.0 - out[:, 0]
+    if fy:
+        out[:, 1] = 1.0 - out[:, 1]
+    return out
+
+
+def pattern_entry(fp, flip, canon):
+    """Index entry of one pattern file in its canonical orientation."""
+    return {
+        'file': fp,
+        'flip': flip,
+        'balls': [{'number': int(b['number']), 'x_norm': b['x_norm'], 'y_norm': b['y_norm']} for b in canon],
+    }
+
+
+def pattern_files(patterns_dir):
+    return sorted(glob.glob(os.path.join(patterns_dir, '*.json')))
+
+
+def build_library(patterns_dir, tol=TOL, cluster_radius=None):
+    """
+    Load, canonicalize, deduplicate and cluster all patterns in `patterns_dir`
+
+    Returns:
+        dict: Library index (see save_library)
+    """
+    if cluster_radius is None:
+        cluster_radius = CLUSTER_FACTOR * tol
+    patterns = []
+    arrays = []
+    duplicate_arrays = []
+    skipped = []
+    for fp in pattern_files(patterns_dir):
+        try:
+            balls, _ = load_positions(fp)
+            flip, canon = canonicalize(balls)
+        except Exception as e:
+            print(f"Skipping pattern '{fp}': failed to load: {e}")
+            skipped.append(fp)
+            continue
+        arr = as_array(canon)
+        # Duplicate of an earlier unique pattern?
+        duplicate_of = None
+        for idx, (other, other_arr) in enumerate(zip(patterns, arrays)):
+            if len(other['balls']) != len(canon):
+                continue
+            if any(distance(flip_array(arr, q), other_arr) <= tol for q in candidate_flips(canon, tol)):
+                duplicate_of = idx
+                break
+        if duplicate_of is not None:
+            # Kept in its own canonical orientation so candidate_flips stays exact for it
+            patterns[duplicate_of]['duplicates'].append(pattern_entry(fp, flip, canon))
+            duplicate_arrays[duplicate_of].append(arr)
+            continue
+        pattern = pattern_entry(fp, flip, canon)
+        pattern['duplicates'] = []
+        patterns.append(pattern)
+        arrays.append(arr)
+        duplicate_arrays.append([])
+
+    # Leader clustering per ball count: each pattern joins the first representative within the radius
+    clusters = []
+    for idx, arr in enumerate(arrays):
+        for cluster in clusters:
+            rep = cluster['representative']
+            if len(arrays[rep]) == len(arr) and distance(arrays[rep], arr) <= cluster_radius:
+                cluster['members'].append(idx)
+                break
+        else:
+            clusters.append({'representative': idx, 'members': [idx]})
+    # The radius covers duplicates too, so pruning by it never skips a matching file
+    for cluster in clusters:
+        rep = arrays[cluster['representative']]
+        cluster['radius'] = max(distance(rep, arr) for m in cluster['members']
+                                for arr in [arrays[m]] + duplicate_arrays[m])
+
+    files = {os.path.basename(fp): os.stat(fp).st_mtime for fp in pattern_files(patterns_dir)}
+    return {
+        'version': INDEX_VERSION,
+        'patterns_dir': patterns_dir,
+        'tol': tol,
+        'cluster_radius': cluster_radius,
+        'files': files,
+        'skipped': skipped,
+        'patterns': patterns,
+        'clusters': clusters,
+    }
+
+
+def save_library(library, path):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(library, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def load_library(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        library = json.load(f)
+    if library.get('version') != INDEX_VERSION:
+        raise ValueError(f"Unsupported pattern library version in '{path}': {library.get('version')}")
+    for pattern in library['patterns']:
+        for entry in [pattern] + pattern['duplicates']:
+            entry['array'] = as_array(entry['balls'])
+    return library
+
+
+def stale_files(library):
+    """Pattern files added, removed or modified since the library was built."""
+    current = {os.path.basename(fp): os.stat(fp).st_mtime for fp in pattern_files(library['patterns_dir'])}
+    indexed = library['files']
+    return sorted(name for name in set(current) | set(indexed) if current.get(name) != indexed.get(name))
+
+
+def query(library, shot, tol=TOL):
+    """
+    Find all library patterns matching the shot (balls compared by number, as with --order)
+
+    Returns:
+        tuple: (matches, best, stats)
+            matches: [{"pattern", "mode", "duplicates"}], one per group of merged patterns:
+                     the matching file (the kept pattern if it matches, otherwise its first
+                     matching duplicate), the flip applied to the shot relative to that file,
+                     and the other files of the group
+            best: closest non-matching candidate {"pattern", "mode", "count", "detail"} or None
+            stats: {"representatives", "compared", "total"} (compared / total count pattern files)
+    """
+    shot_flip, shot_canon = canonicalize(shot)
+    shot_arr = as_array(shot_canon)
+    flips = candidate_flips(shot_canon, tol)
+    variants = [(q, flip_array(shot_arr, q)) for q in flips]
+    patterns = library['patterns']
+
+    matches = []
+    best = None
+    stats = {'representatives': 0, 'compared': 0,
+             'total': sum(1 + len(p['duplicates']) for p in patterns)}
+
+    def check(idx):
+        nonlocal best
+        group = [patterns[idx]] + patterns[idx]['duplicates']
+        for entry in group:
+            stats['compared'] += 1
+            for q, arr in variants:
+                mismatches = int((np.abs(arr - entry['array']) > tol).any(axis=1).sum())
+                if mismatches == 0:
+                    matches.append({
+                        'pattern': entry['file'],
+                        'mode': compose_flips(shot_flip, q, entry['flip']),
+                        'duplicates': [e['file'] for e in group if e is not entry],
+                    })
+                    return
+                if best is None or mismatches < best['count']:
+                    best = {'count': mismatches, 'entry': entry, 'q': q}
+
+    for cluster in library['clusters']:
+        rep = patterns[cluster['representative']]
+        if len(rep['balls']) != len(shot_canon):
+            continue
+        stats['representatives'] += 1
+        d = min(distance(arr, rep['array']) for _, arr in variants)
+        # Every member is within cluster["radius"] of the representative
+        if d > cluster['radius'] + tol:
+            continue
+        for idx in cluster['members']:
+            check(idx)
+
+    if best is not None:
+        pattern = best['entry']
+        mode = compose_flips(shot_flip, best['q'], pattern['flip'])
+        # Report the mismatches in the coordinates of the original pattern file
+        _, detail = compare(sort_balls(apply_flip_to_norms(shot, mode)),
+                            apply_flip_to_norms(pattern['balls'], pattern['flip']), tol=tol)
+        best = {'pattern': pattern['file'], 'mode': mode, 'count': best['count'], 'detail': detail}
+    return matches, best, stats
+
+
+def print_stats(library):
+    patterns = library['patterns']
+    duplicates = sum(len(p['duplicates']) for p in patterns)
+    clusters = library['clusters']
+    sizes = [len(c['members']) for c in clusters]
+    print(f"Pattern files: {len(patterns) + duplicates + len(library['skipped'])} "
+          f"({len(patterns)} unique, {duplicates} duplicate(s), {len(library['skipped'])} skipped)")
+    if sizes:
+        print(f"Clusters: {len(clusters)} (radius {library['cluster_radius']}, "
+              f"largest {max(sizes)}, mean {sum(sizes) / len(sizes):.1f} pattern(s))")
+    for p in patterns:
+        if p['duplicates']:
+            print(f"  {p['file']}: duplicates {', '.join(d['file'] for d in p['duplicates'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build and inspect the canonicalized, deduplicated pattern library')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build = sub.add_parser('build', help='Build the library index from a pattern folder')
+    build.add_argument('--patterns-dir', '-p', default='patterns/position', help='Directory containing pattern JSON files')
+    build.add_argument('--index', '-x', default=DEFAULT_INDEX, help=f'Library index file (default {DEFAULT_INDEX})')
+    build.add_argument('--tol', type=float, default=TOL, help='Patterns within this tolerance are merged (default 0.025)')
+    build.add_argument('--cluster-radius', type=float, help=f'Cluster radius in normalized units (default {CLUSTER_FACTOR:g} x tol)')
+
+    stats = sub.add_parser('stats', help='Show duplicates and clusters of a library index')
+    stats.add_argument('--index', '-x', default=DEFAULT_INDEX, help=f'Library index file (default {DEFAULT_INDEX})')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if not pattern_files(args.patterns_dir):
+            print(f"No pattern JSON files found in '{args.patterns_dir}'")
+            sys.exit(2)
+        library = build_library(args.patterns_dir, args.tol, args.cluster_radius)
+        save_library(library, args.index)
+        print(f"Saved pattern library to {args.index}")
+        print_stats(library)
+    else:
+        try:
+            library = load_library(args.index)
+        except (OSError, ValueError) as e:
+            print('Failed to load pattern library:', e)
+            sys.exit(2)
+        print_stats(library)
+        stale = stale_files(library)
+        if stale:
+            print(f"Warning: {len(stale)} pattern file(s) changed since the library was built; rebuild it")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,19 @@
 #!/usr/bin/env python3
 """
 Interactive position selector
-- Show an image using OpenCV
-- Let user drag rectangles (click-drag)
-- After releasing mouse, prompt in terminal for class name (e.g., ball number)
-- Compute rectangle center in image coords
+- Show an image using OpenCV (large images are shown on a cached downscaled pyramid level)
+- Click to add a point, then type its ball number in the window and press Enter
+- Click an existing point to select it: drag to move, type to relabel, 'x' to delete
+- With --detect, points are pre-seeded from the main.py detector so only corrections are needed
 - If a table corners JSON is provided, compute perspective transform and map center to table coords
 - Compute normalized coords (0-1) relative to table size (or image size)
 - Save results to JSON matching the requested format
 
+The window is only redrawn when the annotations change.
+
 Usage:
   python3 positions-selector.py --image 3.jpg --table-corners table_input.json --output 3-output.json
+  python3 positions-selector.py --image 3.jpg --table-corners table_input.json --detect --profile profiles/table-b.json
 
 """
 
@@ -20,77 +23,150 @@ import json
 import numpy as np
 import os
 
+from calibration import load_table_transform
+from display import DEFAULT_MAX_SIZE, DisplayPyramid, parse_size, window_closed
+
+WINDOW = 'image'
+# Click distance (display pixels) for selecting an existing point
+PICK_RADIUS = 10
+KEY_BACKSPACE = 8
+KEY_ENTER = (10, 13)
+KEY_ESC = 27
+
 # Globals for mouse callback
-refPt = []
-drawing = False
-current_image = None
-clone_image = None
-# rects now holds point annotations: {"pt": (x,y), "class": str}
+pyramid = None
+# rects holds point annotations: {"pt": (x,y) in image coords, "class": str, "seeded": bool}
 rects = []
-current_mouse = None
+selected = None      # index into rects of the selected point
+typing = None        # digits typed for the selected point, None when not editing
+dragging = False
+dirty = True
+
+
+def pick(x, y):
+    """Index of the annotation closest to display point (x, y) within PICK_RADIUS, or None."""
+    best, best_d = None, PICK_RADIUS ** 2
+    for i, r in enumerate(rects):
+        dx, dy = pyramid.to_display(*r['pt'])
+        d = (dx - x) ** 2 + (dy - y) ** 2
+        if d <= best_d:
+            best, best_d = i, d
+    return best
+
+
+def commit_typing():
+    """Apply the typed number to the selected point and leave edit mode."""
+    global typing
+    if selected is not None and typing:
+        rects[selected]['class'] = typing
+        rects[selected]['seeded'] = False
+    typing = None
 
 
 def click_and_drag(event, x, y, flags, param):
-    """Handle single-click: add a point annotation at click location and prompt for class."""
-    global current_image, clone_image, rects
+    """Click: select (and drag) an existing point, or add a new one and start number entry."""
+    global selected, typing, dragging, dirty
     if event == cv2.EVENT_LBUTTONDOWN:
-        # Record point
-        pt = (x, y)
-        rects.append({"pt": pt, "class": ''})
-        # Prompt user for class/name in terminal
-        class_name = input('Enter class/name for clicked point (or press Enter to skip): ').strip()
-        if class_name:
-            rects[-1]['class'] = class_name
-        redraw_annotations()
-        cv2.imshow('image', clone_image)
-
-
-def load_table_transform(tc_file):
-    try:
-        with open(tc_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if 'table_corners' in data and len(data['table_corners']) == 4:
-                corners = np.array(data['table_corners'], dtype=np.float32)
-                widthA = np.linalg.norm(corners[1] - corners[0])
-                widthB = np.linalg.norm(corners[2] - corners[3])
-                maxWidth = int(max(widthA, widthB))
-                heightA = np.linalg.norm(corners[3] - corners[0])
-                heightB = np.linalg.norm(corners[2] - corners[1])
-                maxHeight = int(max(heightA, heightB))
-                dst = np.array([[0, 0], [maxWidth - 1, 0], [maxWidth - 1, maxHeight - 1], [0, maxHeight - 1]], dtype=np.float32)
-                M = cv2.getPerspectiveTransform(corners, dst)
-                return M, (maxWidth, maxHeight)
-            else:
-                print('Table corners file format invalid. Expected key "table_corners" with 4 points.')
-    except FileNotFoundError:
-        print(f"Table corners file '{tc_file}' not found.")
-    except Exception as e:
-        print('Failed to load table corners:', e)
-    return None, None
+        commit_typing()
+        idx = pick(x, y)
+        if idx is None:
+            rects.append({"pt": pyramid.to_image(x, y), "class": '', "seeded": False})
+            idx = len(rects) - 1
+        selected = idx
+        typing = ''
+        dragging = True
+        dirty = True
+    elif event == cv2.EVENT_MOUSEMOVE and dragging and selected is not None:
+        pt = pyramid.to_image(x, y)
+        if pt != rects[selected]['pt']:
+            rects[selected]['pt'] = pt
+            rects[selected]['seeded'] = False
+            dirty = True
+    elif event == cv2.EVENT_LBUTTONUP:
+        dragging = False
 
 
 def redraw_annotations():
-    """Redraw clone_image from current_image and all rectangles in `rects`."""
-    global clone_image, current_image, rects
-    if current_image is None:
-        return
-    clone_image = current_image.copy()
-    for r in rects:
-        pt = tuple(r['pt'])
-        # draw small circle at point
-        cv2.circle(clone_image, pt, 6, (0, 255, 0), -1)
-        cls = r.get('class')
+    """Render the current pyramid level with all points, the selection and the status line."""
+    canvas = pyramid.canvas()
+    for i, r in enumerate(rects):
+        pt = pyramid.to_display(*r['pt'])
+        # Detector suggestions not yet touched are orange, confirmed points green
+        color = (0, 165, 255) if r.get('seeded') else (0, 255, 0)
+        cv2.circle(canvas, pt, 6, color, -1)
+        cls = typing + '_' if i == selected and typing is not None else r.get('class')
+        if i == selected:
+            cv2.circle(canvas, pt, 10, (0, 255, 255), 2)
         if cls:
             text_pos = (pt[0] + 8, pt[1] + 4)
-            cv2.putText(clone_image, str(cls), text_pos, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+            cv2.putText(canvas, str(cls), text_pos, cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    unlabeled = sum(1 for r in rects if not r.get('class'))
+    status = f"Points: {len(rects)} | unlabeled: {unlabeled} | level {pyramid.level}"
+    cv2.putText(canvas, status, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+    cv2.imshow(WINDOW, canvas)
+
+
+def detect_points(img, profile_path=None, profile_name=None, cue_ball=False):
+    """Pre-seed annotations from the main.py detector (image coordinates)."""
+    import main as detector
+    from profiles import compile_profile, load_profile
+
+    profile_data = load_profile(profile_path, profile_name)
+    if cue_ball:
+        profile_data['classifier']['detect_cue_ball'] = True
+    # Only image coordinates are needed here; table mapping uses --table-corners
+    profile = compile_profile(profile_data, calibration=(None, None))
+    balls = detector.find_balls(img, profile)
+    return [{"pt": (int(b['center'][0]), int(b['center'][1])), "class": str(b['number']), "seeded": True}
+            for b in balls]
+
+
+def build_output(img, transform_M, table_size):
+    output = {}
+    balls = []
+    # If transform not provided, use image dims for normalization
+    if table_size is not None:
+        W, H = table_size
+    else:
+        H, W = img.shape[:2]
+    for r in rects:
+        cx, cy = r['pt']
+        # Map to table coords if available
+        if transform_M is not None:
+            src_pt = np.array([[[cx, cy]]], dtype=np.float32)
+            dst_pt = cv2.perspectiveTransform(src_pt, transform_M)[0][0]
+            tx, ty = int(dst_pt[0]), int(dst_pt[1])
+        else:
+            tx, ty = int(cx), int(cy)
+        x_norm = round(tx / W, 6) if W > 0 else 0.0
+        y_norm = round(ty / H, 6) if H > 0 else 0.0
+        entry = {
+            'number': int(r['class']) if isinstance(r.get('class'), str) and r['class'].isdigit() else r.get('class'),
+            'x': tx,
+            'y': ty,
+            'x_norm': x_norm,
+            'y_norm': y_norm
+        }
+        balls.append(entry)
+
+    output['balls'] = balls
+    if table_size is not None:
+        output['table_size'] = {'width': int(table_size[0]), 'height': int(table_size[1])}
+    return output
 
 
 def main():
-    global current_image, clone_image
-    parser = argparse.ArgumentParser(description='Interactive bounding-box selector that outputs table-normalized coordinates')
+    global pyramid, rects, selected, typing, dirty
+    parser = argparse.ArgumentParser(description='Interactive position selector that outputs table-normalized coordinates')
     parser.add_argument('--image', '-i', required=True, help='Input image path')
     parser.add_argument('--table-corners', '-t', help='JSON file containing table_corners (optional)')
     parser.add_argument('--output', '-o', default='positions.json', help='Output JSON file')
+    parser.add_argument('--detect', '-d', action='store_true', help='Pre-seed points with the main.py detector')
+    parser.add_argument('--profile', '-P', help='Detector profile for --detect (JSON/YAML or sweep.py output)')
+    parser.add_argument('--profile-name', help='Pareto front entry when --profile is a sweep.py output')
+    parser.add_argument('--cue-ball', action='store_true', help='Also detect the cue ball (16) with --detect')
+    parser.add_argument('--max-size', type=parse_size, default=DEFAULT_MAX_SIZE,
+                        help='Maximum display size WxH; larger images are shown downscaled (default 1600x900)')
 
     args = parser.parse_args()
 
@@ -103,9 +179,6 @@ def main():
         print('Failed to read image:', args.image)
         return
 
-    current_image = img
-    clone_image = img.copy()
-
     transform_M = None
     table_size = None
     if args.table_corners:
@@ -113,71 +186,80 @@ def main():
         if transform_M is not None:
             print('Loaded table corners. Table size:', table_size)
 
-    cv2.namedWindow('image', cv2.WINDOW_NORMAL)
-    cv2.setMouseCallback('image', click_and_drag)
+    if args.detect:
+        try:
+            rects = detect_points(img, args.profile, args.profile_name, args.cue_ball)
+        except (OSError, ValueError) as e:
+            print('Failed to load detector profile:', e)
+            return
+        print(f'Detector pre-seeded {len(rects)} point(s); orange points are unconfirmed suggestions.')
+
+    pyramid = DisplayPyramid(img, args.max_size)
+    cv2.namedWindow(WINDOW, cv2.WINDOW_NORMAL)
+    cv2.setMouseCallback(WINDOW, click_and_drag)
 
     print('Instructions:')
-    print('- Drag mouse to draw a rectangle; after release, enter class/name in terminal.')
+    print('- Click to add a point, or click an existing point to select / drag it.')
+    print('- Type the ball number in the window, Enter to confirm, Backspace to edit, ESC to cancel.')
+    print("- 'x' deletes the selected point, 'u' removes the last point, '+'/'-' zoom the display.")
     print("- Press 's' to save and exit, 'q' or ESC to quit without saving.")
 
     while True:
-        # Show image; if currently drawing, render a temporary rectangle for feedback
-        if drawing and current_mouse is not None and refPt:
-            img_to_show = clone_image.copy()
-            cv2.rectangle(img_to_show, refPt[0], current_mouse, (0, 255, 0), 2)
-            cv2.imshow('image', img_to_show)
-        else:
-            cv2.imshow('image', clone_image)
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q') or key == 27:
+        if dirty:
+            redraw_annotations()
+            dirty = False
+        # Block for events instead of spinning; nothing is redrawn unless something changed
+        key = cv2.waitKey(50) & 0xFF
+        if key == 0xFF:
+            if window_closed(WINDOW):
+                print('Window closed, exiting without saving.')
+                break
+            continue
+        dirty = True
+        if typing is not None and ord('0') <= key <= ord('9'):
+            if len(typing) < 2:
+                typing += chr(key)
+        elif typing is not None and key == KEY_BACKSPACE:
+            typing = typing[:-1]
+        elif key in KEY_ENTER:
+            commit_typing()
+            if selected is not None:
+                # Enter on a detector suggestion confirms it as is
+                rects[selected]['seeded'] = False
+            selected = None
+        elif key == KEY_ESC and selected is not None:
+            # Cancel the current entry / selection, keep the point as it was
+            typing = None
+            selected = None
+        elif key == ord('q') or key == KEY_ESC:
             print('Exiting without saving.')
             break
+        elif key == ord('x') and selected is not None:
+            removed = rects.pop(selected)
+            print('Deleted point:', removed.get('class', ''))
+            selected, typing = None, None
         elif key == ord('u'):
-            # undo last rectangle
+            # undo last point
             if rects:
                 removed = rects.pop()
-                print('Undid last rectangle:', removed.get('class', ''))
-                redraw_annotations()
-                cv2.imshow('image', clone_image)
+                print('Undid last point:', removed.get('class', ''))
+                selected, typing = None, None
             else:
-                print('No rectangles to undo.')
+                print('No points to undo.')
+        elif key in (ord('+'), ord('=')):
+            pyramid.zoom_in()
+        elif key in (ord('-'), ord('_')):
+            pyramid.zoom_out()
         elif key == ord('s'):
-            # Build JSON
-            output = {}
-            balls = []
-            # If transform not provided, use image dims for normalization
-            if table_size is not None:
-                W, H = table_size
-            else:
-                H, W = img.shape[:2]
-            for r in rects:
-                cx, cy = r['pt']
-                # Map to table coords if available
-                if transform_M is not None:
-                    src_pt = np.array([[[cx, cy]]], dtype=np.float32)
-                    dst_pt = cv2.perspectiveTransform(src_pt, transform_M)[0][0]
-                    tx, ty = int(dst_pt[0]), int(dst_pt[1])
-                else:
-                    tx, ty = int(cx), int(cy)
-                x_norm = round(tx / W, 6) if W > 0 else 0.0
-                y_norm = round(ty / H, 6) if H > 0 else 0.0
-                entry = {
-                    'number': int(r['class']) if isinstance(r.get('class'), str) and r['class'].isdigit() else r.get('class'),
-                    'x': tx,
-                    'y': ty,
-                    'x_norm': x_norm,
-                    'y_norm': y_norm
-                }
-                balls.append(entry)
-
-            output['balls'] = balls
-            if table_size is not None:
-                output['table_size'] = {'width': int(table_size[0]), 'height': int(table_size[1])}
+            commit_typing()
+            output = build_output(img, transform_M, table_size)
             # Save
             with open(args.output, 'w', encoding='utf-8') as f:
                 json.dump(output, f, ensure_ascii=False, indent=2)
             print('Saved to', args.output)
             break
+        else:
+            dirty = False
 
     cv2.destroyAllWindows()
 
@@ -0,0 +1,88 @@
+import os
+
+import cv2
+import numpy as np
+
+def configure_threads(threads=None, opencl=False):
+    """
+    Đặt chính sách luồng của OpenCV cho tiến trình hiện tại
+
+    Khi chạy nhiều tiến trình worker, mỗi tiến trình nên dùng ít luồng OpenCV
+    (xem worker_threads) để tổng số luồng không vượt quá số nhân CPU.
+
+    Args:
+        threads: Số luồng OpenCV (None = giữ mặc định của OpenCV)
+        opencl: Bật T-API (OpenCL, kể cả OpenCL trên CPU) nếu có
+    """
+    if threads is not None:
+        cv2.setNumThreads(int(threads))
+    cv2.ocl.setUseOpenCL(bool(opencl) and cv2.ocl.haveOpenCL())
+
+def worker_threads(workers, cpu_count=None):
+    """Số luồng OpenCV cho mỗi worker để `workers` tiến trình chia đều số nhân CPU."""
+    cpus = cpu_count or os.cpu_count() or 1
+    return max(1, cpus // max(1, workers))
+
+class Preprocessor:
+    """
+    Tính ảnh xám và ảnh đưa vào HoughCircles với bộ đệm cấp phát sẵn
+
+    Các bộ đệm được cấp phát theo kích thước ảnh và dùng lại giữa các frame, nên
+    kết quả của planes() chỉ có hiệu lực đến lần gọi tiếp theo; copy nếu cần giữ lại.
+    Với use_umat=True, phép tính chạy qua T-API (cv2.UMat) và ảnh đưa vào
+    HoughCircles được giữ dạng UMat.
+    """
+
+    def __init__(self, profile, use_umat=None):
+        self.plane = profile['plane']
+        self.blur = profile['blur']
+        if use_umat is None:
+            use_umat = profile.get('opencl', False)
+        self.use_umat = bool(use_umat) and cv2.ocl.haveOpenCL()
+        self._shape = None
+
+    def _allocate(self, shape):
+        h, w = shape[:2]
+        self._gray = np.empty((h, w), dtype=np.uint8)
+        self._channels = [np.empty((h, w), dtype=np.uint8) for _ in range(3)]
+        self._combined = np.empty((h, w), dtype=np.uint8)
+        self._blurred = np.empty((h, w), dtype=np.uint8)
+        self._shape = shape
+
+    def planes(self, img):
+        """
+        Returns:
+            tuple: (gray, combined); gray luôn là numpy, combined là numpy hoặc UMat
+        """
+        if self.use_umat:
+            return self._planes_umat(img)
+        if img.shape != self._shape:
+            self._allocate(img.shape)
+
+        cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        if self.plane == 'gray':
+            combined = self._gray
+        else:
+            # Kênh lớn nhất: tách vào bộ đệm rồi max tại chỗ, không cấp phát mảng mới
+            cv2.split(img, self._channels)
+            b, g, r = self._channels
+            cv2.max(b, g, dst=self._combined)
+            cv2.max(self._combined, r, dst=self._combined)
+            combined = self._combined
+        if self.blur:
+            cv2.medianBlur(combined, self.blur, dst=self._blurred)
+            combined = self._blurred
+        return self._gray, combined
+
+    def _planes_umat(self, img):
+        u = cv2.UMat(img)
+        gray_u = cv2.cvtColor(u, cv2.COLOR_BGR2GRAY)
+        if self.plane == 'gray':
+            combined = gray_u
+        else:
+            b, g, r = cv2.split(u)
+            combined = cv2.max(cv2.max(b, g), r)
+        if self.blur:
+            combined = cv2.medianBlur(combined, self.blur)
+        # Thống kê màu trong ROI cần numpy, HoughCircles nhận trực tiếp UMat
+        return gray_u.get(), combined
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Detector profiles
+- A profile is a JSON (or YAML, if PyYAML is installed) file describing one table/camera setup:
+  calibration path, pre-processing, HoughCircles settings, classifier tables, pockets, output and
+  rectification options
+- Profiles are merged over DEFAULT_PROFILE, validated, and compiled once at startup into
+  ready-to-use structures (HoughCircles kwargs, color table rows, loaded table transform)
+- Sweep results from sweep.py can be loaded directly by naming a Pareto front entry
+
+Usage:
+  python3 profiles.py profiles/table-a.json            # validate and print the merged profile
+  python3 profiles.py sweep.json --name pareto-1 --save profiles/fast.json
+
+"""
+
+import argparse
+import copy
+import json
+import sys
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from calibration import TABLE_CORNERS_FILE, load_table_transform
+
+# Cấu hình mặc định, tương đương các hằng số trước đây trong main.py
+DEFAULT_PROFILE = {
+    'name': 'default',
+    'calibration': {
+        'table_corners_file': TABLE_CORNERS_FILE,
+    },
+    'preprocess': {
+        'plane': 'max',  # 'max': kênh màu lớn nhất, 'gray': ảnh xám
+        'blur': 0,       # Kích thước median blur trước HoughCircles (0 = tắt)
+        'opencl': False, # Chạy tiền xử lý qua OpenCV T-API (UMat), kể cả OpenCL trên CPU
+    },
+    'hough': {
+        'dp': 1.0,
+        'min_dist': 15,
+        'param1': 200,
+        'param2': 15,
+        'min_radius': 8,
+        'max_radius': 13,
+    },
+    'classifier': {
+        'ball_min_radius': 8,      # Bán kính nhỏ nhất được coi là bi
+        'ball_max_radius': 12,     # Bán kính lớn nhất được coi là bi
+        'min_avg_color': 50,       # Giá trị màu trung bình tối thiểu của ROI bi
+        'detect_cue_ball': False,
+        # Khoảng [min, max] của B, G, R và độ sáng cho từng bi; bi đầu tiên khớp được chọn
+        'colors': {
+            '1': {'b': [20, 90], 'g': [150, 230], 'r': [150, 230], 'brightness': [140, 190]},    # Vàng sáng
+            '2': {'b': [140, 190], 'g': [80, 120], 'r': [10, 45], 'brightness': [70, 110]},      # Xanh dương
+            '3': {'b': [30, 100], 'g': [25, 90], 'r': [110, 255], 'brightness': [70, 140]},      # Đỏ
+            '4': {'b': [155, 170], 'g': [90, 100], 'r': [200, 240], 'brightness': [130, 150]},   # Hồng
+            '5': {'b': [30, 95], 'g': [80, 145], 'r': [160, 225], 'brightness': [100, 160]},     # Cam
+            '6': {'b': [80, 120], 'g': [100, 150], 'r': [15, 45], 'brightness': [75, 110]},      # Xanh lá đậm
+            '7': {'b': [55, 125], 'g': [70, 140], 'r': [65, 135], 'brightness': [75, 125]},      # Xanh lá nhạt
+            '8': {'b': [75, 110], 'g': [55, 90], 'r': [25, 55], 'brightness': [50, 80]},         # Xanh đậm
+            '9': {'b': [80, 135], 'g': [165, 205], 'r': [160, 230], 'brightness': [165, 200]},   # Vàng nhạt
+            '10': {'b': [170, 210], 'g': [120, 160], 'r': [65, 105], 'brightness': [115, 145]},  # Xanh dương nhạt
+            '11': {'b': [95, 115], 'g': [95, 105], 'r': [210, 230], 'brightness': [125, 150]},   # Đỏ viền trắng
+            '12': {'b': [169, 209], 'g': [122, 162], 'r': [201, 241], 'brightness': [151, 191]}, # Hồng viền trắng
+            '13': {'b': [87, 127], 'g': [135, 175], 'r': [204, 244], 'brightness': [149, 189]},  # Cam viền trắng
+            '14': {'b': [117, 157], 'g': [136, 176], 'r': [65, 105], 'brightness': [110, 150]},  # Xanh lá viền trắng
+            '15': {'b': [91, 131], 'g': [117, 157], 'r': [149, 189], 'brightness': [124, 164]},  # Tím viền trắng
+        },
+        # Bi 16 (cue ball), chỉ dùng khi detect_cue_ball = True
+        'cue_ball': {'b': [160, 255], 'g': [160, 255], 'r': [160, 255], 'brightness': [160, 255]},
+    },
+    'pockets': {
+        'enabled': True,        # Tìm 6 lỗ (cần file góc bàn)
+        'cache': True,          # Lưu vị trí lỗ vào file góc bàn, dùng lại cho các lần chạy sau
+        'search_radius': 0.04,  # Bán kính vùng tìm quanh vị trí danh nghĩa, theo tỉ lệ đường chéo bàn
+        'min_radius': 8,
+        'max_radius': 30,
+        'max_intensity': 50,    # Độ sáng tối đa bên trong lỗ
+    },
+    'output': {
+        'annotated_dir': 'output/annotated',
+        'position_dir': 'output/position',
+        'write_annotated': True,
+        'json_indent': 2,
+        'jsonl': None,          # Gộp tọa độ mọi ảnh vào một file JSON Lines (None = mỗi ảnh một file)
+        'writer_threads': 2,    # Số luồng ghi file ở nền (0 = ghi đồng bộ)
+        'max_pending': 16,      # Số ảnh/file tối đa đang chờ ghi
+    },
+    'rectify': {
+        'enabled': False,       # Ghi thêm ảnh bàn nhìn từ trên xuống của mỗi frame (cần file góc bàn)
+        'output': 'output/rectified',  # Thư mục ảnh, hoặc file video (.mp4, .avi, ...)
+        'scale': 1.0,           # Tỉ lệ kích thước output so với kích thước bàn
+        'interpolation': 'linear',  # 'linear' hoặc 'nearest'
+        'fps': 30.0,            # FPS khi output là video
+    },
+}
+
+# Tên tham số phẳng (dùng bởi sweep.py) -> section trong profile
+PARAM_SECTIONS = {
+    'dp': 'hough',
+    'min_dist': 'hough',
+    'param1': 'hough',
+    'param2': 'hough',
+    'min_radius': 'hough',
+    'max_radius': 'hough',
+    'ball_min_radius': 'classifier',
+    'ball_max_radius': 'classifier',
+    'min_avg_color': 'classifier',
+}
+
+COLOR_CHANNELS = ('b', 'g', 'r', 'brightness')
+PLANES = ('max', 'gray')
+INTERPOLATIONS = ('nearest', 'linear')
+
+
+def _merge(base, override, path=''):
+    """Recursively merge `override` into a copy of `base`, rejecting unknown keys."""
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        where = f"{path}.{key}" if path else key
+        if key not in base:
+            raise ValueError(f"Unknown profile key '{where}'")
+        # Color tables are replaced as a whole so a profile can drop or reorder balls
+        if isinstance(base[key], dict) and key not in ('colors', 'cue_ball'):
+            if not isinstance(value, dict):
+                raise ValueError(f"Profile key '{where}' must be an object")
+            merged[key] = _merge(base[key], value, where)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def _check_range(where, rng):
+    if (not isinstance(rng, (list, tuple)) or len(rng) != 2
+            or not all(isinstance(v, (int, float)) for v in rng)):
+        raise ValueError(f"'{where}' must be a [min, max] pair of numbers")
+    if not 0 <= rng[0] <= rng[1] <= 255:
+        raise ValueError(f"'{where}' must satisfy 0 <= min <= max <= 255, got {list(rng)}")
+
+
+def _check_color(where, entry):
+    if not isinstance(entry, dict) or set(entry) != set(COLOR_CHANNELS):
+        raise ValueError(f"'{where}' must have exactly the keys {', '.join(COLOR_CHANNELS)}")
+    for ch in COLOR_CHANNELS:
+        _check_range(f"{where}.{ch}", entry[ch])
+
+
+def validate_profile(profile):
+    """Raise ValueError if a merged profile is inconsistent."""
+    h = profile['hough']
+    for key in ('dp', 'min_dist', 'param1', 'param2'):
+        if not isinstance(h[key], (int, float)) or h[key] <= 0:
+            raise ValueError(f"'hough.{key}' must be a positive number")
+    for key in ('min_radius', 'max_radius'):
+        if not isinstance(h[key], int) or h[key] < 0:
+            raise ValueError(f"'hough.{key}' must be a non-negative integer")
+    if h['min_radius'] > h['max_radius']:
+        raise ValueError("'hough.min_radius' must not exceed 'hough.max_radius'")
+
+    c = profile['classifier']
+    for key in ('ball_min_radius', 'ball_max_radius', 'min_avg_color'):
+        if not isinstance(c[key], (int, float)) or c[key] < 0:
+            raise ValueError(f"'classifier.{key}' must be a non-negative number")
+    if c['ball_min_radius'] > c['ball_max_radius']:
+        raise ValueError("'classifier.ball_min_radius' must not exceed 'classifier.ball_max_radius'")
+    if not isinstance(c['detect_cue_ball'], bool):
+        raise ValueError("'classifier.detect_cue_ball' must be true or false")
+    if not isinstance(c['colors'], dict) or not c['colors']:
+        raise ValueError("'classifier.colors' must be a non-empty object keyed by ball number")
+    for num, entry in c['colors'].items():
+        if not str(num).isdigit() or not 1 <= int(num) <= 15:
+            raise ValueError(f"'classifier.colors' key '{num}' must be a ball number 1-15")
+        _check_color(f"classifier.colors.{num}", entry)
+    _check_color('classifier.cue_ball', c['cue_ball'])
+
+    p = profile['preprocess']
+    if p['plane'] not in PLANES:
+        raise ValueError(f"'preprocess.plane' must be one of: {', '.join(PLANES)}")
+    if not isinstance(p['blur'], int) or p['blur'] < 0 or (p['blur'] > 0 and (p['blur'] < 3 or p['blur'] % 2 == 0)):
+        raise ValueError("'preprocess.blur' must be 0 or an odd integer >= 3")
+    if not isinstance(p['opencl'], bool):
+        raise ValueError("'preprocess.opencl' must be true or false")
+
+    pk = profile['pockets']
+    for key in ('enabled', 'cache'):
+        if not isinstance(pk[key], bool):
+            raise ValueError(f"'pockets.{key}' must be true or false")
+    if not isinstance(pk['search_radius'], (int, float)) or not 0 < pk['search_radius'] <= 0.5:
+        raise ValueError("'pockets.search_radius' must be in (0, 0.5]")
+    for key in ('min_radius', 'max_radius'):
+        if not isinstance(pk[key], int) or pk[key] < 1:
+            raise ValueError(f"'pockets.{key}' must be a positive integer")
+    if pk['min_radius'] > pk['max_radius']:
+        raise ValueError("'pockets.min_radius' must not exceed 'pockets.max_radius'")
+    if not isinstance(pk['max_intensity'], (int, float)) or not 0 <= pk['max_intensity'] <= 255:
+        raise ValueError("'pockets.max_intensity' must be in [0, 255]")
+
+    if not isinstance(profile['name'], str) or not profile['name']:
+        raise ValueError("'name' must be a non-empty string")
+
+    o = profile['output']
+    for key in ('annotated_dir', 'position_dir'):
+        if not isinstance(o[key], str) or not o[key]:
+            raise ValueError(f"'output.{key}' must be a directory path")
+    if not isinstance(o['write_annotated'], bool):
+        raise ValueError("'output.write_annotated' must be true or false")
+    if o['json_indent'] is not None and (not isinstance(o['json_indent'], int) or o['json_indent'] < 0):
+        raise ValueError("'output.json_indent' must be a non-negative integer or null")
+    if o['jsonl'] is not None and not isinstance(o['jsonl'], str):
+        raise ValueError("'output.jsonl' must be a path or null")
+    if not isinstance(o['writer_threads'], int) or o['writer_threads'] < 0:
+        raise ValueError("'output.writer_threads' must be a non-negative integer")
+    if not isinstance(o['max_pending'], int) or o['max_pending'] < 1:
+        raise ValueError("'output.max_pending' must be a positive integer")
+    r = profile['rectify']
+    if not isinstance(r['enabled'], bool):
+        raise ValueError("'rectify.enabled' must be true or false")
+    if not isinstance(r['output'], str) or not r['output']:
+        raise ValueError("'rectify.output' must be a directory or video path")
+    if not isinstance(r['scale'], (int, float)) or not 0 < r['scale'] <= 4:
+        raise ValueError("'rectify.scale' must be in (0, 4]")
+    if r['interpolation'] not in INTERPOLATIONS:
+        raise ValueError(f"'rectify.interpolation' must be one of: {', '.join(INTERPOLATIONS)}")
+    if not isinstance(r['fps'], (int, float)) or r['fps'] <= 0:
+        raise ValueError("'rectify.fps' must be a positive number")
+    if not isinstance(profile['calibration']['table_corners_file'], str):
+        raise ValueError("'calibration.table_corners_file' must be a path")
+
+
+def profile_from_params(params, base=None, name=None):
+    """Build a profile from flat parameter names (as produced by sweep.py) over `base`."""
+    override = {}
+    for key, value in params.items():
+        if key not in PARAM_SECTIONS:
+            raise ValueError(f"Unknown detector parameter '{key}'")
+        override.setdefault(PARAM_SECTIONS[key], {})[key] = value
+    if name is not None:
+        override['name'] = name
+    profile = _merge(base if base is not None else DEFAULT_PROFILE, override)
+    validate_profile(profile)
+    return profile
+
+
+def profile_to_params(profile):
+    """Inverse of profile_from_params: flatten the tunable parameters of a profile."""
+    return {key: profile[section][key] for key, section in PARAM_SECTIONS.items()}
+
+
+def _read_file(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError(f"Cannot read '{path}': YAML profiles need PyYAML (pip install pyyaml)")
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+def load_profile(path=None, name=None):
+    """
+    Load, merge and validate a profile
+
+    Args:
+        path: Profile file (JSON/YAML) or sweep.py output; None for DEFAULT_PROFILE
+        name: Pareto front entry to use when `path` is a sweep.py output
+
+    Returns:
+        dict: Merged, validated profile
+    """
+    if path is None:
+        return copy.deepcopy(DEFAULT_PROFILE)
+    data = _read_file(path)
+    if not isinstance(data, dict):
+        raise ValueError(f"Profile '{path}' must contain an object")
+    if 'front' in data:
+        entries = {e['name']: e['params'] for e in data['front']}
+        if name is None:
+            raise ValueError(f"'{path}' contains several parameter sets; choose one of: {', '.join(entries)}")
+        if name not in entries:
+            raise ValueError(f"Parameter set '{name}' not found in '{path}' (available: {', '.join(entries)})")
+        base = _merge(DEFAULT_PROFILE, data['base_profile']) if 'base_profile' in data else None
+        return profile_from_params(entries[name], base=base, name=name)
+    profile = _merge(DEFAULT_PROFILE, data)
+    validate_profile(profile)
+    return profile
+
+
+def color_row(num, entry):
+    """Compile one color entry into (ball number, lower bounds, upper bounds) over COLOR_CHANNELS."""
+    return (int(num), tuple(entry[ch][0] for ch in COLOR_CHANNELS), tuple(entry[ch][1] for ch in COLOR_CHANNELS))
+
+
+def compile_profile(profile, calibration=None):
+    """
+    Compile a validated profile into the structures used per frame
+
+    Args:
+        profile: Profile from load_profile
+        calibration: (transform_M, table_size) already loaded; if None the
+            profile's table corners file is read once here
+
+    Returns:
+        dict: Compiled profile (see keys below)
+    """
+    h = profile['hough']
+    c = profile['classifier']
+    if calibration is None:
+        calibration = load_table_transform(profile['calibration']['table_corners_file'])
+    transform_M, table_size = calibration
+
+    color_table = [color_row(num, entry) for num, entry in c['colors'].items()]
+    if c['detect_cue_ball']:
+        color_table.append(color_row(16, c['cue_ball']))
+
+    return {
+        'name': profile['name'],
+        'profile': profile,
+        'table_corners_file': profile['calibration']['table_corners_file'],
+        'transform_M': transform_M,
+        'table_size': table_size,
+        'plane': profile['preprocess']['plane'],
+        'blur': profile['preprocess']['blur'],
+        'opencl': profile['preprocess']['opencl'],
+        'hough': {
+            'dp': float(h['dp']),
+            'minDist': float(h['min_dist']),
+            'param1': float(h['param1']),
+            'param2': float(h['param2']),
+            'minRadius': int(h['min_radius']),
+            'maxRadius': int(h['max_radius']),
+        },
+        'ball_radius': (c['ball_min_radius'], c['ball_max_radius']),
+        'min_avg_color': c['min_avg_color'],
+        'detect_cue_ball': c['detect_cue_ball'],
+        'color_table': color_table,
+        'pockets': dict(profile['pockets']),
+        'output': dict(profile['output']),
+        'rectify': dict(profile['rectify']),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate a detector profile and print (or save) the merged result')
+    parser.add_argument('profile', nargs='?', help='Profile file (JSON/YAML) or sweep.py output; omit for the default profile')
+    parser.add_argument('--name', '-n', help='Pareto front entry name when the file is a sweep.py output')
+    parser.add_argument('--save', '-s', help='Save the merged profile as JSON to this path')
+
+    args = parser.parse_args()
+
+    try:
+        profile = load_profile(args.profile, args.name)
+    except (OSError, ValueError) as e:
+        print('Invalid profile:', e)
+        sys.exit(2)
+
+    text = json.dumps(profile, ensure_ascii=False, indent=2)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"Profile '{profile['name']}' saved to {args.save}")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
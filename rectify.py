@@ -0,0 +1,163 @@
+import os
+import queue
+
+import cv2
+import numpy as np
+
+from calibration import calibration_key
+from output_writer import OutputWriter
+
+INTERPOLATIONS = {'nearest': cv2.INTER_NEAREST, 'linear': cv2.INTER_LINEAR}
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov')
+
+# Bảng remap theo (khóa calibration, kích thước output), dùng lại cho mọi frame trong tiến trình
+_map_cache = {}
+
+def rectified_size(table_size, scale=1.0):
+    """Kích thước (width, height) của ảnh bàn nhìn từ trên xuống ở tỉ lệ `scale`."""
+    return max(1, int(round(table_size[0] * scale))), max(1, int(round(table_size[1] * scale)))
+
+def output_transform(transform_M, table_size, out_size):
+    """Ma trận perspective ảnh -> ảnh bàn kích thước `out_size` (góc bàn ở đúng 4 góc ảnh)."""
+    sx = (out_size[0] - 1) / max(1, table_size[0] - 1)
+    sy = (out_size[1] - 1) / max(1, table_size[1] - 1)
+    return np.diag([sx, sy, 1.0]) @ transform_M
+
+def build_maps(transform_M, table_size, out_size):
+    """
+    Tính bảng remap fixed-point (CV_16SC2 + bảng nội suy CV_16UC1) cho một calibration
+
+    Mỗi pixel (u, v) của ảnh bàn lấy mẫu tại inv(M) · (u, v, 1) trong ảnh gốc,
+    giống cv2.warpPerspective nhưng chỉ tính một lần.
+    """
+    inv = np.linalg.inv(output_transform(transform_M, table_size, out_size))
+    w, h = out_size
+    u, v = np.meshgrid(np.arange(w, dtype=np.float64), np.arange(h, dtype=np.float64))
+    x = inv[0, 0] * u + inv[0, 1] * v + inv[0, 2]
+    y = inv[1, 0] * u + inv[1, 1] * v + inv[1, 2]
+    z = inv[2, 0] * u + inv[2, 1] * v + inv[2, 2]
+    map_x = (x / z).astype(np.float32)
+    map_y = (y / z).astype(np.float32)
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+def get_maps(transform_M, table_size, image_shape, out_size):
+    """Bảng remap cho calibration hiện tại; chỉ tính lần đầu rồi dùng lại."""
+    key = (calibration_key(transform_M, image_shape), tuple(out_size))
+    if key not in _map_cache:
+        _map_cache[key] = build_maps(transform_M, table_size, out_size)
+    return _map_cache[key]
+
+class Rectifier:
+    """
+    Tạo ảnh bàn nhìn từ trên xuống cho từng frame bằng cv2.remap với bảng tính sẵn
+
+    Không truyền `dst`: ảnh output được ghi vào `buffers` bộ đệm (cấp phát ở lần dùng đầu tiên),
+    dùng xoay vòng, nên kết quả chỉ có hiệu lực đến khi đã gọi thêm `buffers` lần. Khi frame được ghi ở luồng
+    nền, người gọi tự quản lý bộ đệm (new_buffer() + `dst`) và chỉ dùng lại bộ đệm khi việc ghi
+    của nó đã xong (xem RectifiedStream).
+    """
+
+    def __init__(self, transform_M, table_size, image_shape, scale=1.0, interpolation='linear', buffers=1):
+        self.size = rectified_size(table_size, scale)
+        self.interpolation = INTERPOLATIONS[interpolation]
+        self.map1, self.map2 = get_maps(transform_M, table_size, image_shape, self.size)
+        self.image_shape = tuple(image_shape)
+        w, h = self.size
+        channels = image_shape[2:] if len(image_shape) > 2 else ()
+        self._buffer_shape = (h, w) + tuple(channels)
+        self._buffers = [None] * max(1, buffers)
+        self._next = 0
+
+    def new_buffer(self):
+        """Bộ đệm rỗng đúng kích thước output, dùng làm `dst` cho rectify()."""
+        return np.empty(self._buffer_shape, dtype=np.uint8)
+
+    def rectify(self, img, dst=None):
+        if img.shape != self.image_shape:
+            raise ValueError(f"Frame size {img.shape[1]}x{img.shape[0]} does not match the calibration "
+                             f"({self.image_shape[1]}x{self.image_shape[0]})")
+        if dst is None:
+            if self._buffers[self._next] is None:
+                self._buffers[self._next] = self.new_buffer()
+            dst = self._buffers[self._next]
+            self._next = (self._next + 1) % len(self._buffers)
+        cv2.remap(img, self.map1, self.map2, self.interpolation, dst=dst, borderMode=cv2.BORDER_CONSTANT)
+        return dst
+
+class RectifiedStream:
+    """
+    Ghi ảnh bàn đã nắn thẳng của mọi frame, song song với kết quả detect
+
+    - `output` có đuôi video (.mp4, .avi, ...): ghi thành một video theo đúng thứ tự frame,
+      ở một luồng nền riêng
+    - Ngược lại `output` là thư mục: mỗi frame một ảnh cùng tên với ảnh gốc, ghi qua `writer`
+    - Rectifier được tạo ở frame đầu tiên (cần kích thước ảnh) và dùng lại cho các frame sau
+      cùng kích thước
+    - Bộ đệm output lấy từ một pool (max_pending + 1 bộ đệm) và chỉ được trả về pool khi việc
+      ghi frame đó đã xong, nên các luồng ghi hoàn thành không theo thứ tự cũng không đọc
+      phải bộ đệm đã bị frame sau ghi đè
+
+    Usage:
+        stream = RectifiedStream(profile['transform_M'], profile['table_size'], profile['rectify'], writer)
+        stream.write('1.jpg', img)
+        stream.close()
+    """
+
+    def __init__(self, transform_M, table_size, config, writer):
+        self.transform_M = transform_M
+        self.table_size = table_size
+        self.config = config
+        self.output = config['output']
+        self.frames = 0
+        self._writer = writer
+        self._rectifier = None
+        self._free = None
+        self._video = None
+        self._video_writer = None
+        if self.output.lower().endswith(VIDEO_EXTENSIONS):
+            folder = os.path.dirname(self.output)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            # Tối đa một luồng để giữ thứ tự frame trong video
+            self._video_writer = OutputWriter(threads=min(1, writer.threads), max_pending=writer.max_pending)
+        else:
+            os.makedirs(self.output, exist_ok=True)
+
+    def write(self, name, img):
+        """Nắn thẳng frame `img` và ghi (ảnh `name` trong thư mục output, hoặc frame tiếp theo của video)."""
+        if self._rectifier is None or img.shape != self._rectifier.image_shape:
+            self._rectifier = Rectifier(self.transform_M, self.table_size, img.shape, self.config['scale'],
+                                        self.config['interpolation'])
+            # Đủ bộ đệm cho mọi frame còn đang chờ ghi ở luồng nền cộng frame đang tính
+            self._free = queue.Queue()
+            for _ in range(self._writer.max_pending + 1):
+                self._free.put(self._rectifier.new_buffer())
+        free = self._free
+        # Chờ đến khi một việc ghi trước đó xong và trả bộ đệm về
+        frame = free.get()
+        try:
+            self._rectifier.rectify(img, dst=frame)
+        except BaseException:
+            free.put(frame)
+            raise
+        done = lambda: free.put(frame)
+        if self._video_writer is not None:
+            if self._video is None:
+                fourcc = cv2.VideoWriter_fourcc(*('mp4v' if self.output.lower().endswith('.mp4') else 'MJPG'))
+                self._video = cv2.VideoWriter(self.output, fourcc, self.config['fps'], self._rectifier.size)
+                if not self._video.isOpened():
+                    raise OSError(f"Failed to open video '{self.output}' for writing")
+            self._video_writer.write_frame(self._video, frame, done=done)
+        else:
+            self._writer.write_image(os.path.join(self.output, name), frame, done=done)
+        self.frames += 1
+
+    def close(self, raise_errors=True):
+        """Chờ ghi xong và đóng video (nếu có); ảnh trong thư mục output được flush cùng `writer`."""
+        try:
+            if self._video_writer is not None:
+                self._video_writer.close(raise_errors=raise_errors)
+        finally:
+            if self._video is not None:
+                self._video.release()
+                self._video = None
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Parameter sweep for the main.py detector
+- Evaluate a grid (or a random sample) of HoughCircles / classifier gate parameters on a labeled image set
+- Images are decoded and their gray/max-channel planes computed once, then reused by every trial
+- Trials run in parallel worker processes; each trial is scored with the evaluate.py matcher
+- Output every trial plus the Pareto front of accuracy vs. per-frame latency; front entries
+  are named (pareto-1, pareto-2, ...) and can be loaded with `main.py --profile FILE --profile-name NAME`
+
+Usage:
+  python3 sweep.py --images input --labels labels --output sweep.json
+  python3 sweep.py --images input --labels labels --space space.json --random 200 --workers 8
+  python3 sweep.py --images input --labels labels --profile profiles/table-b.json
+
+A search space file maps parameter names (see profiles.PARAM_SECTIONS) to lists of values:
+  {"param2": [12, 15, 18], "min_dist": [10, 15, 20]}
+
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import main as detector
+from calibration import load_table_transform
+from compare_positions import TOL, load_positions
+from evaluate import filter_balls, find_pairs, score_frame, summarize
+from preprocess import configure_threads, worker_threads
+from profiles import PARAM_SECTIONS, compile_profile, load_profile, profile_from_params, profile_to_params
+
+# Default search space around the hand-tuned values of the default profile
+SEARCH_SPACE = {
+    'dp': [1.0, 1.2, 1.5],
+    'min_dist': [10, 15, 20],
+    'param1': [150, 200, 250],
+    'param2': [12, 15, 18, 22],
+    'min_radius': [7, 8],
+    'max_radius': [12, 13, 14],
+    'ball_min_radius': [8],
+    'ball_max_radius': [12, 13],
+    'min_avg_color': [40, 50, 60],
+}
+
+METRICS = ['f1', 'recall', 'precision', 'classification_accuracy']
+
+# Per-worker dataset: list of (stem, img, planes, prep_ms, labeled_balls)
+_dataset = []
+_base_profile = None
+_calibration = (None, None)
+_tol = TOL
+
+
+def load_dataset(pairs, profile):
+    """Decode every image once and precompute its detection planes."""
+    dataset = []
+    for stem, image_path, label_path in pairs:
+        img = cv2.imread(image_path)
+        if img is None:
+            print(f"Warning: failed to read image {image_path}, skipping")
+            continue
+        labeled, _ = load_positions(label_path)
+        t0 = time.perf_counter()
+        planes = detector.prepare_planes(img, profile)
+        prep_ms = (time.perf_counter() - t0) * 1000.0
+        dataset.append((stem, img, planes, prep_ms, labeled))
+    return dataset
+
+
+def init_worker(pairs, base_profile, calibration, tol, threads=None):
+    global _dataset, _base_profile, _calibration, _tol
+    configure_threads(threads, base_profile['preprocess']['opencl'])
+    _base_profile = base_profile
+    _calibration = calibration
+    _tol = tol
+    # With the fork start method the parent's dataset is inherited copy-on-write
+    if not _dataset:
+        _dataset = load_dataset(pairs, compile_profile(base_profile, calibration))
+
+
+def build_trials(space, base_profile, n_random=None, seed=0):
+    """Expand the search space into a list of complete, valid parameter dicts."""
+    unknown = set(space) - set(PARAM_SECTIONS)
+    if unknown:
+        raise ValueError(f"Unknown parameter(s) in search space: {', '.join(sorted(unknown))}")
+    keys = sorted(space)
+    if n_random is None:
+        combos = [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+    else:
+        rng = random.Random(seed)
+        seen = set()
+        combos = []
+        total = int(np.prod([len(space[k]) for k in keys])) if keys else 1
+        while len(combos) < min(n_random, total):
+            values = tuple(rng.choice(space[k]) for k in keys)
+            if values not in seen:
+                seen.add(values)
+                combos.append(dict(zip(keys, values)))
+
+    defaults = profile_to_params(base_profile)
+    trials = []
+    for combo in combos:
+        params = dict(defaults)
+        params.update(combo)
+        try:
+            profile_from_params(params, base=base_profile)
+        except ValueError:
+            # e.g. min_radius > max_radius; such combinations are simply skipped
+            continue
+        trials.append(params)
+    return trials
+
+
+def run_trial(params):
+    """Worker: run one parameter set over the cached dataset and summarize it."""
+    # Trial parameters never touch preprocessing, so the cached planes stay valid
+    profile = compile_profile(profile_from_params(params, base=_base_profile), _calibration)
+    records = []
+    for stem, img, planes, prep_ms, labeled in _dataset:
+        t0 = time.perf_counter()
+        detected_balls = detector.find_balls(img, profile, planes)
+        positions = detector.build_positions(detected_balls, profile['transform_M'], profile['table_size'], img.shape)
+        detect_ms = (time.perf_counter() - t0) * 1000.0
+        record = score_frame(stem, filter_balls(positions['balls']), labeled, _tol)
+        # Planes are shared between trials, so charge their one-off cost to every frame
+        record['detect_ms'] = round(prep_ms + detect_ms, 3)
+        record['decode_ms'] = 0.0
+        records.append(record)
+    summary = summarize(records)
+    return {'params': params, 'summary': summary}
+
+
+def pareto_front(results, metric):
+    """Return results not dominated in (higher `metric`, lower latency), sorted by latency."""
+    def key(r):
+        return r['summary'][metric], r['summary']['timing_ms']['detect_mean']
+
+    front = []
+    for r in sorted(results, key=lambda r: (key(r)[1], -key(r)[0])):
+        acc, _ = key(r)
+        # Sorted by latency, so a point is on the front only if it beats every faster one
+        if not front or acc > key(front[-1])[0]:
+            front.append(r)
+    return front
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep detector parameters over a labeled image set')
+    parser.add_argument('--images', '-i', required=True, help='Directory of images')
+    parser.add_argument('--labels', '-l', required=True, help='Directory of labeled position JSON files')
+    parser.add_argument('--profile', '-P', help='Base detector profile; swept parameters override it (default: built-in profile)')
+    parser.add_argument('--table-corners', '-t', help="JSON file containing table_corners (default: the profile's calibration)")
+    parser.add_argument('--space', '-s', help='JSON file with the search space (default: built-in SEARCH_SPACE)')
+    parser.add_argument('--random', type=int, help='Evaluate N random configurations instead of the full grid')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for --random (default 0)')
+    parser.add_argument('--metric', choices=METRICS, default='f1', help='Accuracy metric for the Pareto front (default f1)')
+    parser.add_argument('--tol', type=float, default=TOL, help='Match tolerance for x_norm and y_norm (default 0.025)')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+    parser.add_argument('--cv-threads', type=int,
+                        help='OpenCV threads per worker (default: CPU cores / workers, OpenCV default when serial)')
+    parser.add_argument('--output', '-o', default='sweep.json', help='Output JSON file (default sweep.json)')
+
+    args = parser.parse_args()
+
+    space = SEARCH_SPACE
+    if args.space:
+        with open(args.space, 'r', encoding='utf-8') as f:
+            space = json.load(f)
+    try:
+        base_profile = load_profile(args.profile)
+        trials = build_trials(space, base_profile, args.random, args.seed)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(2)
+    if not trials:
+        print('Search space produced no valid configurations.')
+        sys.exit(2)
+
+    pairs, missing = find_pairs(args.labels, images_dir=args.images)
+    if missing:
+        print(f"Warning: {len(missing)} label file(s) have no matching image: {', '.join(missing[:10])}")
+    if not pairs:
+        print('No label/image pairs found.')
+        sys.exit(2)
+
+    global _dataset
+    tc_file = args.table_corners or base_profile['calibration']['table_corners_file']
+    calibration = load_table_transform(tc_file)
+    threads = args.cv_threads
+    if threads is None and args.workers > 1:
+        threads = worker_threads(args.workers)
+    init_args = (pairs, base_profile, calibration, args.tol, threads)
+
+    print(f"Sweeping {len(trials)} configuration(s) over {len(pairs)} image(s) with {args.workers} worker(s)...")
+    t0 = time.perf_counter()
+    if args.workers <= 1:
+        init_worker(*init_args)
+        results = [run_trial(p) for p in trials]
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        if 'fork' in methods:
+            # Decode once in the parent; forked workers share the pages
+            _dataset = load_dataset(pairs, compile_profile(base_profile, calibration))
+            ctx = multiprocessing.get_context('fork')
+        else:
+            ctx = multiprocessing.get_context()
+        with ctx.Pool(args.workers, initializer=init_worker, initargs=init_args) as pool:
+            results = list(pool.imap_unordered(run_trial, trials))
+    elapsed = time.perf_counter() - t0
+
+    front = pareto_front(results, args.metric)
+    front_out = []
+    for rank, r in enumerate(front, 1):
+        s = r['summary']
+        front_out.append({
+            'name': f'pareto-{rank}',
+            'params': r['params'],
+            args.metric: s[args.metric],
+            'f1': s['f1'],
+            'classification_accuracy': s['classification_accuracy'],
+            'latency_ms': s['timing_ms']['detect_mean'],
+        })
+
+    output = {
+        'metric': args.metric,
+        'images': len(pairs),
+        # Front entries are loaded on top of this profile by profiles.load_profile
+        'base_profile': base_profile,
+        'trials': [{'params': r['params'], 'summary': {k: v for k, v in r['summary'].items() if k != 'per_number'}}
+                   for r in results],
+        'front': front_out,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+
+    print(f"Done in {elapsed:.1f}s")
+    print('Pareto front (accuracy vs. latency):')
+    print(f"{'Name':<12} {args.metric:>10} {'ClsAcc':>8} {'ms/frame':>9}  Changed params")
+    for entry in front_out:
+        changed = {k: v for k, v in entry['params'].items() if base_profile[PARAM_SECTIONS[k]][k] != v}
+        print(f"{entry['name']:<12} {entry[args.metric]:>10.4f} {entry['classification_accuracy']:>8.4f} "
+              f"{entry['latency_ms']:>9.2f}  {changed if changed else '(defaults)'}")
+    print(f"Saved to {args.output}")
+    print(f"Use a front entry with: python main.py --profile {args.output} --profile-name pareto-1")
+
+
+if __name__ == '__main__':
+    main()
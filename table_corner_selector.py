@@ -3,45 +3,66 @@ import numpy as np
 import json
 import argparse
 
+from display import DEFAULT_MAX_SIZE, DisplayPyramid, parse_size, window_closed
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Billiard Table Corner Selection Tool")
     parser.add_argument("--input_file", type=str, default="input.jpg", help="Path to input image (billiard table)")
     parser.add_argument("--output_file", type=str, default="output.jpg", help="Path to save output image with marked corners")
     parser.add_argument("--json_file", type=str, default="table.json", help="Path to save JSON file containing corner coordinates")
+    parser.add_argument("--max_size", type=parse_size, default=DEFAULT_MAX_SIZE, help="Maximum display size WxH; larger images are shown downscaled (default 1600x900)")
     return parser.parse_args()
 
-def drag_points(image, points):
+def draw_corners(img, points):
+    for idx, (px, py) in enumerate(points):
+        cv2.circle(img, (px, py), 8, (0, 255, 0), -1)
+        cv2.putText(img, f"{idx+1}", (px+10, py-10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,0), 2)
+    cv2.polylines(img, [np.array(points, np.int32).reshape((-1,1,2))], isClosed=True, color=(255,0,255), thickness=2)
+
+def drag_points(image, points, max_size=DEFAULT_MAX_SIZE):
+    # Large images are shown on a cached pyrDown level; points stay in full-resolution coordinates
+    pyramid = DisplayPyramid(image, max_size)
     dragging_idx = None
+    dirty = True
 
     def mouse_callback(event, x, y, flags, param):
-        nonlocal dragging_idx
+        nonlocal dragging_idx, dirty
         if event == cv2.EVENT_LBUTTONDOWN:
             for i, (px, py) in enumerate(points):
-                if abs(x - px) < 15 and abs(y - py) < 15:
+                dx, dy = pyramid.to_display(px, py)
+                if abs(x - dx) < 15 and abs(y - dy) < 15:
                     dragging_idx = i
         elif event == cv2.EVENT_LBUTTONUP:
             dragging_idx = None
         elif event == cv2.EVENT_MOUSEMOVE and dragging_idx is not None:
-            points[dragging_idx] = [x, y]
+            pt = list(pyramid.to_image(x, y))
+            if pt != points[dragging_idx]:
+                points[dragging_idx] = pt
+                dirty = True
 
-    clone = image.copy()
     cv2.namedWindow("Set Table Corners")
     cv2.setMouseCallback("Set Table Corners", mouse_callback)
 
     while True:
-        disp = clone.copy()
-        for idx, (px, py) in enumerate(points):
-            cv2.circle(disp, (px, py), 8, (0, 255, 0), -1)
-            cv2.putText(disp, f"{idx+1}", (px+10, py-10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,0), 2)
-        cv2.polylines(disp, [np.array(points, np.int32).reshape((-1,1,2))], isClosed=True, color=(255,0,255), thickness=2)
-        cv2.putText(disp, "Drag corners. Press ENTER to save. ESC to cancel.", (30, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,255), 2)
-        cv2.imshow("Set Table Corners", disp)
-        key = cv2.waitKey(1)
+        # Redraw only after a corner moved or the zoom level changed
+        if dirty:
+            disp = pyramid.canvas()
+            draw_corners(disp, [pyramid.to_display(px, py) for px, py in points])
+            cv2.putText(disp, "Drag corners. +/- to zoom. ENTER to save. ESC to cancel.", (30, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,255), 2)
+            cv2.imshow("Set Table Corners", disp)
+            dirty = False
+        key = cv2.waitKey(50)
         if key in [13, 10]:  # ENTER
             break
         elif key == 27:  # ESC
             cv2.destroyWindow("Set Table Corners")
             return None
+        elif key in [ord('+'), ord('=')]:
+            dirty = pyramid.zoom_in()
+        elif key in [ord('-'), ord('_')]:
+            dirty = pyramid.zoom_out()
+        elif key == -1 and window_closed("Set Table Corners"):
+            return None
     cv2.destroyWindow("Set Table Corners")
     return points
 
@@ -61,7 +82,7 @@ def main():
         [int(w*0.95), int(h*0.95)],
         [int(w*0.05), int(h*0.95)]
     ]
-    points = drag_points(img, default_points)
+    points = drag_points(img, default_points, args.max_size)
     if points is None:
         print("Operation cancelled.")
         return
@@ -74,10 +95,7 @@ def main():
 
     # Draw corners on the image and save it
     img_marked = img.copy()
-    for idx, (px, py) in enumerate(points):
-        cv2.circle(img_marked, (px, py), 8, (0, 255, 0), -1)
-        cv2.putText(img_marked, f"{idx+1}", (px+10, py-10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,0), 2)
-    cv2.polylines(img_marked, [np.array(points, np.int32).reshape((-1,1,2))], isClosed=True, color=(255,0,255), thickness=2)
+    draw_corners(img_marked, points)
     cv2.imwrite(args.output_file, img_marked)
     print(f"Marked image saved to {args.output_file}")
 